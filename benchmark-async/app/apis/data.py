@@ -0,0 +1,116 @@
+from quart import Blueprint, Response, abort, request
+import os
+import random
+
+from app.db import close_pool, get_db_connection, open_pool
+
+data_api = Blueprint('data_api', __name__)
+
+# One pool per worker, opened before the first request is accepted
+data_api.before_app_serving(open_pool)
+data_api.after_app_serving(close_pool)
+
+WRITE_ROWS = 2000
+DEFAULT_WRITE_MODE = os.environ.get('DATA_WRITE_MODE', 'copy')
+DEFAULT_READ_MODE = os.environ.get('DATA_READ_MODE', 'count')
+DEFAULT_READ_BATCH_SIZE = int(os.environ.get('DATA_READ_BATCH_SIZE', '2000'))
+
+async def read_rows(conn, batch_size):
+    # Original behaviour: pull every row into the worker and count them here
+    return len(await conn.fetch('SELECT * FROM read_heavy;'))
+
+async def read_count(conn, batch_size):
+    # Let the database do the aggregation and send back a single row
+    return await conn.fetchval('SELECT count(*) FROM read_heavy;')
+
+async def read_stream(conn, batch_size):
+    # Server-side cursor, so at most batch_size rows are held in the worker at once
+    count = 0
+    async for rows in fetch_batches(conn, batch_size):
+        count += len(rows)
+    return count
+
+async def fetch_batches(conn, batch_size):
+    async with conn.transaction():
+        cur = await conn.cursor('SELECT * FROM read_heavy;')
+        while True:
+            rows = await cur.fetch(batch_size)
+            if not rows:
+                break
+            yield rows
+
+async def export_rows(batch_size):
+    # The pooled connection is held until the last chunk is sent or the client goes away
+    async with get_db_connection() as conn:
+        async for rows in fetch_batches(conn, batch_size):
+            yield ''.join(f"{row[0]}\n" for row in rows).encode()
+
+READ_MODES = {
+    'rows': read_rows,
+    'count': read_count,
+    'stream': read_stream,
+}
+
+async def write_per_row(conn, write_id, names):
+    # Original behaviour: one round trip per inserted and per deleted row
+    for name in names:
+        await conn.execute("INSERT INTO write_heavy (write_id, write_name) VALUES ($1, $2)", write_id, name)
+    for name in names:
+        await conn.execute("DELETE FROM write_heavy WHERE write_id = $1 AND write_name = $2", write_id, name)
+
+async def write_values(conn, write_id, names):
+    # One INSERT expanding an array parameter into rows, then a single set-based DELETE
+    await conn.execute("INSERT INTO write_heavy (write_id, write_name) SELECT $1, unnest($2::varchar[])",
+                       write_id, names)
+    await delete_batch(conn, write_id, names)
+
+async def write_copy(conn, write_id, names):
+    # Stream the rows through COPY, then a single set-based DELETE
+    await conn.copy_records_to_table('write_heavy', records=[(write_id, name) for name in names],
+                                     columns=['write_id', 'write_name'])
+    await delete_batch(conn, write_id, names)
+
+async def delete_batch(conn, write_id, names):
+    await conn.execute("DELETE FROM write_heavy WHERE write_id = $1 AND write_name = ANY($2::varchar[])",
+                       write_id, names)
+
+WRITE_MODES = {
+    'row': write_per_row,
+    'values': write_values,
+    'copy': write_copy,
+}
+
+@data_api.route('/dataapi/read')
+async def test_read():
+    mode = request.args.get('mode', DEFAULT_READ_MODE)
+    try:
+        batch_size = int(request.args.get('batch_size', DEFAULT_READ_BATCH_SIZE))
+    except ValueError:
+        abort(400, "batch_size must be a positive integer")
+    if batch_size <= 0:
+        abort(400, "batch_size must be a positive integer")
+
+    # Chunked response streaming every row out of a server-side cursor
+    if mode == 'export':
+        return Response(export_rows(batch_size), mimetype='text/plain')
+    if mode not in READ_MODES:
+        abort(400, f"Unknown read mode '{mode}', expected one of {', '.join(READ_MODES)}, export")
+
+    async with get_db_connection() as conn:
+        count = await READ_MODES[mode](conn, batch_size)
+    return f"{count}"
+
+@data_api.route('/dataapi/write')
+async def test_write():
+    mode = request.args.get('mode', DEFAULT_WRITE_MODE)
+    if mode not in WRITE_MODES:
+        abort(400, f"Unknown write mode '{mode}', expected one of {', '.join(WRITE_MODES)}")
+
+    random_num = random.randint(1, 1000000)
+    names = [str(i) for i in range(WRITE_ROWS)]
+    async with get_db_connection() as conn:
+        # All inserts and deletes of a request share one transaction
+        async with conn.transaction():
+            await WRITE_MODES[mode](conn, random_num, names)
+    changes = 2 * len(names)
+    return f"Changes: {changes}"
\ No newline at end of file
@@ -0,0 +1,16 @@
+from quart import Quart
+from app.apis.data import data_api
+
+# Create the Quart app, the async counterpart of the Flask data function
+app = Quart(__name__)
+
+# Define a route within app
+@app.route('/')
+async def index():
+    return 'Hello from app!'
+
+# Register the blueprints with the app
+app.register_blueprint(data_api)
+
+if __name__ == '__main__':
+    app.run()
\ No newline at end of file
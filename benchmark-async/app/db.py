@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Connection settings, overridable per deployment through the environment
+DB_SETTINGS = {
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'port': int(os.environ.get('DB_PORT', '5433')),
+    'database': os.environ.get('DB_NAME', 'db'),
+    'user': os.environ.get('DB_USER', 'postgres'),
+    'password': os.environ.get('DB_PASSWORD', 'postgres_pass'),
+    'timeout': float(os.environ.get('DB_CONNECT_TIMEOUT', '5')),
+}
+
+# Pool sizing; an async worker multiplexes many requests over these connections
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '2'))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '20'))
+POOL_MAX_INACTIVE_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def open_pool():
+    global _pool
+    try:
+        _pool = await asyncpg.create_pool(min_size=POOL_MIN_SIZE,
+                                          max_size=POOL_MAX_SIZE,
+                                          max_inactive_connection_lifetime=POOL_MAX_INACTIVE_LIFETIME,
+                                          **DB_SETTINGS)
+    except (OSError, asyncpg.PostgresError) as e:
+        # The database may not be reachable yet; the pool is created on first use instead
+        logger.warning("Could not open database pool: %s", e)
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def get_pool():
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                await open_pool()
+        if _pool is None:
+            raise ConnectionError("database pool is not available")
+    return _pool
+
+
+@asynccontextmanager
+async def get_db_connection():
+    pool = await get_pool()
+    async with pool.acquire(timeout=POOL_TIMEOUT) as conn:
+        yield conn
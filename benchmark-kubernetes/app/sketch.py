@@ -0,0 +1,167 @@
+import glob
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# Recent-latency window served at /metrics/latency, split into slots that expire one at a time
+WINDOW_SECONDS = float(os.environ.get('LATENCY_WINDOW_SECONDS', '60'))
+WINDOW_SLOTS = int(os.environ.get('LATENCY_WINDOW_SLOTS', '6'))
+RELATIVE_ACCURACY = float(os.environ.get('LATENCY_SKETCH_ACCURACY', '0.01'))
+
+# With gunicorn each worker publishes its sketches here so any worker can answer for the pod
+SKETCH_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+FLUSH_INTERVAL = 1.0
+
+QUANTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+
+class DDSketch:
+    """Quantile sketch with relative error bounded by ``relative_accuracy``.
+
+    Values fall into logarithmic bins, so two sketches with the same
+    accuracy merge exactly by adding their bin counts.
+    """
+
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        if value <= self.MIN_VALUE:
+            self.zero_count += 1
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + 1
+        self.count += 1
+
+    def merge(self, other):
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {'zero': self.zero_count, 'bins': dict(self.bins)}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls()
+        sketch.zero_count = data['zero']
+        sketch.bins = {int(index): count for index, count in data['bins'].items()}
+        sketch.count = sketch.zero_count + sum(sketch.bins.values())
+        return sketch
+
+
+class WindowedSketch:
+    """A DDSketch per time slot; only slots inside the window are ever merged."""
+
+    def __init__(self, window=WINDOW_SECONDS, slots=WINDOW_SLOTS):
+        self.window = window
+        self.slot_seconds = window / slots
+        self.slots = deque(maxlen=slots)
+
+    def add(self, value, now):
+        start = now - now % self.slot_seconds
+        if not self.slots or self.slots[-1][0] != start:
+            self.slots.append((start, DDSketch()))
+        self.slots[-1][1].add(value)
+
+    def live(self, now):
+        return [(start, sketch) for start, sketch in self.slots if start > now - self.window]
+
+
+class LatencySketches:
+    """Windowed latency sketches per route, merged across gunicorn workers."""
+
+    def __init__(self, sketch_dir=SKETCH_DIR):
+        self.sketch_dir = sketch_dir
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def observe(self, endpoint, seconds):
+        now = time.time()
+        with self._lock:
+            window = self._routes.get(endpoint)
+            if window is None:
+                window = self._routes[endpoint] = WindowedSketch()
+            window.add(seconds, now)
+            flush = self.sketch_dir is not None and now - self._last_flush >= FLUSH_INTERVAL
+            if flush:
+                self._last_flush = now
+                state = self._dump(now)
+        if flush:
+            self._write(state)
+
+    def summary(self):
+        """p50/p95/p99 in seconds and sample count per route over the window."""
+        now = time.time()
+        merged = {}
+        with self._lock:
+            state = self._dump(now)
+        for other in self._read_others():
+            for endpoint, slots in other.items():
+                state.setdefault(endpoint, []).extend(slots)
+
+        for endpoint, slots in state.items():
+            sketch = DDSketch()
+            for start, data in slots:
+                if start > now - WINDOW_SECONDS:
+                    sketch.merge(DDSketch.from_dict(data))
+            if sketch.count:
+                merged[endpoint] = {'count': sketch.count,
+                                    **{name: sketch.quantile(q) for name, q in QUANTILES}}
+        return {'window_seconds': WINDOW_SECONDS, 'routes': merged}
+
+    def _dump(self, now):
+        return {endpoint: [(start, sketch.to_dict()) for start, sketch in window.live(now)]
+                for endpoint, window in self._routes.items()}
+
+    def _path(self, pid):
+        return os.path.join(self.sketch_dir, f"sketch_{pid}.json")
+
+    def _write(self, state):
+        tmp = self._path(os.getpid()) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp, self._path(os.getpid()))
+
+    def _read_others(self):
+        if self.sketch_dir is None:
+            return []
+        others = []
+        own = self._path(os.getpid())
+        for path in glob.glob(os.path.join(self.sketch_dir, 'sketch_*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    others.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return others
+
+
+LATENCY_SKETCHES = LatencySketches()
@@ -0,0 +1,27 @@
+import os
+import shutil
+
+# Workers write their samples here; must be set before any worker imports prometheus_client
+multiproc_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus-multiproc')
+
+from prometheus_client import CollectorRegistry, multiprocess, start_http_server
+
+bind = '0.0.0.0:8000'
+metrics_port = int(os.environ.get('METRICS_PORT', '8080'))
+
+
+def on_starting(server):
+    # Drop samples left over from a previous run of the pod
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def when_ready(server):
+    # A single exporter in the master aggregates the histograms of every worker
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(metrics_port, registry=registry)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+
+from flask import g
+from prometheus_client import Counter, Histogram
+
+STARTUP_PHASE = Histogram(
+    'app_startup_phase_seconds', 'Seconds from process start until each startup phase completed', ['phase'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60)
+)
+FIRST_REQUEST = Histogram(
+    'app_first_request_seconds', 'Latency of the first request served by a process',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+COLD_STARTS = Counter('app_cold_starts_total', 'Processes that served their first request')
+
+
+def process_start_time():
+    """Wall-clock time the kernel started this process, or None off Linux."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22 is the start time in clock ticks after boot; the command name may contain spaces
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (AttributeError, OSError, ValueError, IndexError):
+        return None
+    return time.time() - age
+
+
+class StartupTimer:
+    """Seconds from process start to the end of each startup phase."""
+
+    def __init__(self):
+        self.loaded = time.time()
+        # Without /proc, fall back to the moment this module was imported
+        self.started = process_start_time() or self.loaded
+        self.phases = {}
+        self.cold = True
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        elapsed = time.time() - self.started
+        self.phases[phase] = elapsed
+        STARTUP_PHASE.labels(phase).observe(elapsed)
+
+    def take_cold(self):
+        # True for exactly one request per process
+        with self._lock:
+            cold, self.cold = self.cold, False
+        return cold
+
+    def server_timing(self, first_request):
+        # Duration of each phase in milliseconds, in the Server-Timing header format
+        timings, previous = [], 0.0
+        for phase, elapsed in self.phases.items():
+            timings.append(f"{phase};dur={(elapsed - previous) * 1000:.1f}")
+            previous = elapsed
+        timings.append(f"first_request;dur={first_request * 1000:.1f}")
+        return ', '.join(timings)
+
+
+STARTUP = StartupTimer()
+
+
+def mark_phase(phase):
+    STARTUP.mark(phase)
+
+
+def start_first_request():
+    if STARTUP.cold:
+        g.startup_request_start = time.perf_counter()
+
+
+def mark_first_request(response):
+    started = g.pop('startup_request_start', None)
+    if started is not None and STARTUP.take_cold():
+        duration = time.perf_counter() - started
+        FIRST_REQUEST.observe(duration)
+        COLD_STARTS.inc()
+        response.headers['X-Cold-Start'] = '1'
+        response.headers['Server-Timing'] = STARTUP.server_timing(duration)
+    return response
+
+
+def init_startup(app):
+    """Mark ``app`` as created and flag the first response of the process.
+
+    Call once the app is fully set up. The first response carries
+    ``X-Cold-Start: 1`` and a Server-Timing header with the duration of
+    every startup phase.
+    """
+    mark_phase('app')
+    app.before_request(start_first_request)
+    app.after_request(mark_first_request)
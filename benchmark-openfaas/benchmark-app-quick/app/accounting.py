@@ -0,0 +1,96 @@
+import os
+import time
+
+from flask import g, jsonify
+from prometheus_client import Counter, Gauge
+
+from app.metrics import OBSERVATIONS, collect_registry
+
+PEAK_RSS = Gauge(
+    'http_request_peak_rss_bytes', 'Highest resident set size of the worker at the end of a request',
+    ['endpoint'], multiprocess_mode='max'
+)
+GB_SECONDS = Counter(
+    'http_request_gb_seconds_total', 'Request wall time multiplied by worker resident memory in GB', ['endpoint']
+)
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# Per worker, so the gauge is only written when a route reaches a new high
+_peaks = {}
+_gb_seconds = {}
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None off Linux."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def record_memory(endpoint, rss, wall):
+    if rss > _peaks.get(endpoint, 0):
+        _peaks[endpoint] = rss
+        PEAK_RSS.labels(endpoint).set(rss)
+    gb_seconds = _gb_seconds.get(endpoint)
+    if gb_seconds is None:
+        gb_seconds = _gb_seconds[endpoint] = GB_SECONDS.labels(endpoint)
+    gb_seconds.inc(wall * rss / 1e9)
+
+
+def record_usage(response):
+    route, wall_start, _ = g.metrics_timer
+    rss = current_rss()
+    if rss is not None:
+        OBSERVATIONS.record(record_memory, route.endpoint, rss, (time.perf_counter_ns() - wall_start) / 1e9)
+    return response
+
+
+def route_usage(registry):
+    """Invocations, CPU and wall seconds, peak RSS and GB-seconds per route."""
+    routes = {}
+
+    def route(labels):
+        return routes.setdefault(labels['endpoint'], {
+            'invocations': 0, 'errors': 0, 'cpu_seconds': 0.0, 'wall_seconds': 0.0,
+            'peak_rss_bytes': None, 'gb_seconds': 0.0,
+        })
+
+    for family in registry.collect():
+        for sample in family.samples:
+            if sample.name == 'http_requests_total':
+                usage = route(sample.labels)
+                usage['invocations'] += int(sample.value)
+                if sample.labels['status_class'] == '5xx':
+                    usage['errors'] += int(sample.value)
+            elif sample.name == 'http_request_cpu_seconds_sum':
+                route(sample.labels)['cpu_seconds'] += sample.value
+            elif sample.name == 'http_request_latency_seconds_sum':
+                route(sample.labels)['wall_seconds'] += sample.value
+            elif sample.name == 'http_request_peak_rss_bytes':
+                usage = route(sample.labels)
+                usage['peak_rss_bytes'] = max(usage['peak_rss_bytes'] or 0, int(sample.value))
+            elif sample.name == 'http_request_gb_seconds_total':
+                route(sample.labels)['gb_seconds'] += sample.value
+
+    for usage in routes.values():
+        calls = usage['invocations']
+        usage['cpu_seconds_per_request'] = usage['cpu_seconds'] / calls if calls else None
+        usage['gb_seconds_per_request'] = usage['gb_seconds'] / calls if calls else None
+    return routes
+
+
+def resource_usage():
+    # Totals since the worker (or, under gunicorn, the pod) started
+    return jsonify({'routes': route_usage(collect_registry())})
+
+
+def init_accounting(app):
+    """Account CPU, memory and invocations per route of ``app``, served at /metrics/resources.
+
+    Must come after init_metrics, whose timings it reuses.
+    """
+    app.after_request(record_usage)
+    app.add_url_rule('/metrics/resources', 'resource_usage', resource_usage)
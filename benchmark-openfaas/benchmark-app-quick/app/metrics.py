@@ -0,0 +1,258 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from flask import g, jsonify, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+from app.sketch import LATENCY_SKETCHES
+
+logger = logging.getLogger(__name__)
+
+# Requests that match no route share one label value, so stray URLs cannot grow the registry
+UNMATCHED_ENDPOINT = '<unmatched>'
+
+# Under gunicorn with a shared mmap directory the samples of every worker are merged on scrape
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+# Buffered observations reach prometheus_client at least this often, and on every
+# scrape; 0 applies every update on the request path instead
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '1'))
+MAX_PENDING = 1024
+
+REQUEST_LATENCY = Histogram(
+    'http_request_latency_seconds', 'Latency of HTTP requests in seconds', ['method', 'endpoint']
+)
+REQUEST_CPU = Histogram(
+    'http_request_cpu_seconds', 'CPU time spent by the handler thread in seconds', ['method', 'endpoint']
+)
+REQUEST_QUEUE = Histogram(
+    'http_request_queue_seconds', 'Time between X-Request-Start and the worker picking up the request',
+    ['method', 'endpoint']
+)
+REQUEST_COUNT = Counter(
+    'http_requests_total', 'Total number of HTTP requests', ['method', 'endpoint', 'status_class']
+)
+ACTIVE_REQUESTS = Gauge(
+    'http_active_requests', 'Number of requests being handled', ['method', 'endpoint'],
+    multiprocess_mode='livesum'
+)
+
+
+class RouteMetrics:
+    """Label children of one method and route, bound once instead of on every request."""
+
+    def __init__(self, method, endpoint):
+        self.method = method
+        self.endpoint = endpoint
+        self.latency = REQUEST_LATENCY.labels(method, endpoint)
+        self.cpu = REQUEST_CPU.labels(method, endpoint)
+        self.queue = REQUEST_QUEUE.labels(method, endpoint)
+        self.active = ACTIVE_REQUESTS.labels(method, endpoint)
+        self.counts = {}
+
+    def observe(self, latency, cpu, status):
+        self.latency.observe(latency)
+        self.cpu.observe(cpu)
+        status_class = f"{status // 100}xx"
+        count = self.counts.get(status_class)
+        if count is None:
+            count = self.counts[status_class] = REQUEST_COUNT.labels(self.method, self.endpoint, status_class)
+        count.inc()
+        LATENCY_SKETCHES.observe(self.endpoint, latency)
+
+
+class ObservationBuffer:
+    """Per-thread queues of pending metric updates, applied in batches.
+
+    ``record`` appends to the calling thread's deque, which takes no lock.
+    The updates reach prometheus_client on every scrape, from a background
+    thread every ``interval`` seconds so the gunicorn master's exporter
+    stays current, and from any thread whose queue passes ``max_pending``.
+    With ``interval`` 0 updates are applied directly and nothing is queued.
+    """
+
+    def __init__(self, interval=FLUSH_INTERVAL, max_pending=MAX_PENDING):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._local = threading.local()
+        self._queues = []
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+
+    def record(self, update, *args):
+        if self.interval <= 0:
+            update(*args)
+            return
+        try:
+            pending = self._local.pending
+        except AttributeError:
+            pending = self._register()
+        pending.append((update, args))
+        if len(pending) > self.max_pending:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            queues = list(self._queues)
+        finished = set()
+        for thread, pending in queues:
+            # Checked before draining, so nothing can be appended after the last pop
+            alive = thread.is_alive()
+            while True:
+                try:
+                    update, args = pending.popleft()
+                except IndexError:
+                    break
+                update(*args)
+            if not alive:
+                finished.add(id(pending))
+        if finished:
+            # The scrape and the background thread may both drop the same queue
+            with self._lock:
+                self._queues[:] = [queue for queue in self._queues if id(queue[1]) not in finished]
+
+    def _register(self):
+        pending = self._local.pending = deque()
+        with self._lock:
+            self._queues.append((threading.current_thread(), pending))
+            # Started in the worker itself; a thread would not survive gunicorn's fork
+            if self._flusher_pid != os.getpid():
+                self._flusher_pid = os.getpid()
+                threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+                atexit.register(self.flush)
+        return pending
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                # Keep flushing; a dead flusher would let the buffers grow until a scrape
+                logger.exception("Failed to flush metric observations")
+
+
+OBSERVATIONS = ObservationBuffer()
+
+_routes = {}
+_routes_lock = threading.Lock()
+
+
+def route_metrics(method, endpoint):
+    route = _routes.get((method, endpoint))
+    if route is None:
+        with _routes_lock:
+            route = _routes.get((method, endpoint))
+            if route is None:
+                route = _routes[(method, endpoint)] = RouteMetrics(method, endpoint)
+    return route
+
+
+def bind_routes(app):
+    """Bind the label children of every route of ``app``, so requests only look them up."""
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        for method in rule.methods - {'HEAD', 'OPTIONS'}:
+            route_metrics(method, rule.rule)
+
+
+def endpoint_label():
+    # Label by the matched rule (e.g. /computeapi/sieve/<limit>) rather than the raw path
+    if request.url_rule is None:
+        return UNMATCHED_ENDPOINT
+    return request.url_rule.rule
+
+
+def queue_seconds(header, now_ns):
+    """Queue wait from an ``X-Request-Start`` header, or None.
+
+    Proxies send ``t=<epoch>`` (or a bare epoch) in seconds, milliseconds,
+    microseconds or nanoseconds; the unit is inferred from the magnitude.
+    """
+    try:
+        start = float(header.strip().removeprefix('t='))
+    except ValueError:
+        return None
+    if start > 1e17:
+        start_ns = start
+    elif start > 1e14:
+        start_ns = start * 1e3
+    elif start > 1e11:
+        start_ns = start * 1e6
+    else:
+        start_ns = start * 1e9
+    return max(now_ns - start_ns, 0) / 1e9
+
+
+def start_timer():
+    # Every access through Flask's request and g proxies costs a lookup, so each is touched once
+    req = request._get_current_object()
+    rule = req.url_rule
+    route = route_metrics(req.method, UNMATCHED_ENDPOINT if rule is None else rule.rule)
+    route.active.inc()
+    g.metrics_timer = (route, time.perf_counter_ns(), time.thread_time_ns())
+
+    header = req.environ.get('HTTP_X_REQUEST_START')
+    if header:
+        queued = queue_seconds(header, time.time_ns())
+        if queued is not None:
+            OBSERVATIONS.record(route.queue.observe, queued)
+
+
+def record_request(response):
+    route, wall_start, cpu_start = g.metrics_timer
+    latency = (time.perf_counter_ns() - wall_start) / 1e9
+    cpu = (time.thread_time_ns() - cpu_start) / 1e9
+    OBSERVATIONS.record(route.observe, latency, cpu, response.status_code)
+    return response
+
+
+def finish_request(exc):
+    # Runs even when the handler raised, so the gauge cannot drift upwards
+    timer = g.pop('metrics_timer', None)
+    if timer is not None:
+        timer[0].active.dec()
+
+
+def collect_registry():
+    # Under gunicorn, a registry that reads the samples of every worker
+    OBSERVATIONS.flush()
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics():
+    return generate_latest(collect_registry()), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+
+def latency_summary():
+    # Recent p50/p95/p99 per route as compact JSON, no Prometheus text to parse
+    OBSERVATIONS.flush()
+    return jsonify(LATENCY_SKETCHES.summary())
+
+
+def init_metrics(app):
+    """Time every request of ``app`` and serve the results at /metrics.
+
+    Records wall and handler CPU time, queue wait when a proxy sets
+    X-Request-Start, in-flight requests and counts per status class.
+    Recent latency quantiles per route are served at /metrics/latency.
+
+    Call after registering the app's routes: their label children are bound
+    here, and those of routes added later on their first request.
+    """
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    app.teardown_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    app.add_url_rule('/metrics/latency', 'latency_summary', latency_summary)
+    bind_routes(app)
@@ -0,0 +1,199 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, abort, g, jsonify, request
+
+from app.metrics import endpoint_label
+
+# Fraction of requests profiled; 0 leaves the middleware out entirely unless the header is allowed
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+# Lets a caller force profiling of one request with "X-Profile: 1"
+PROFILE_HEADER_ENABLED = os.environ.get('PROFILE_HEADER_ENABLED', '0') == '1'
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_WINDOW = float(os.environ.get('PROFILE_WINDOW_SECONDS', '300'))
+
+ADMIN_PREFIX = '/admin/profile'
+SORT_KEYS = [key.value for key in pstats.SortKey]
+
+
+class RouteProfile:
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.stats = None
+        self.stacks = Counter()
+
+
+class Profiler:
+    """Profiles sampled requests and aggregates the results per route.
+
+    Each sampled request runs under cProfile for pstats output, while a
+    background thread samples its Python stack every ``interval`` seconds
+    for collapsed-stack (flamegraph) output. A route's aggregate starts
+    over once it is older than ``window`` seconds.
+    """
+
+    def __init__(self, sample_rate, interval, window):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.window = window
+        self._routes = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler = None
+
+    def should_sample(self):
+        if PROFILE_HEADER_ENABLED and request.headers.get('X-Profile') == '1':
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, route):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running in this process
+            return None
+        self._active[threading.get_ident()] = route
+        self._ensure_sampler()
+        self._wake.set()
+        return profile
+
+    def stop(self, route, profile):
+        profile.disable()
+        self._active.pop(threading.get_ident(), None)
+        with self._lock:
+            record = self._record(route)
+            record.requests += 1
+            if record.stats is None:
+                record.stats = pstats.Stats(profile)
+            else:
+                record.stats.add(profile)
+
+    def routes(self):
+        with self._lock:
+            return {route: {'requests': record.requests,
+                            'stack_samples': sum(record.stacks.values()),
+                            'window_started': record.started}
+                    for route, record in self._routes.items()}
+
+    def collapsed(self, route=None):
+        # One "frame;frame;frame count" line per stack, rooted at the route, for flamegraph.pl or speedscope
+        with self._lock:
+            lines = [f"{name};{stack} {count}"
+                     for name, record in self._routes.items() if route in (None, name)
+                     for stack, count in record.stacks.items()]
+        return '\n'.join(lines) + '\n'
+
+    def stats(self, route):
+        with self._lock:
+            record = self._routes.get(route)
+            if record is None or record.stats is None:
+                return None
+            # Copy so sorting and printing never race with requests adding to the aggregate
+            merged = pstats.Stats()
+            merged.add(record.stats)
+        return merged
+
+    def _record(self, route):
+        record = self._routes.get(route)
+        if record is None or time.time() - record.started > self.window:
+            record = self._routes[route] = RouteProfile()
+        return record
+
+    def _ensure_sampler(self):
+        if self._sampler is None:
+            with self._lock:
+                if self._sampler is None:
+                    self._sampler = threading.Thread(target=self._sample_loop, name='route-profiler', daemon=True)
+                    self._sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            if not self._active:
+                # Sleep until the next sampled request instead of polling
+                self._wake.clear()
+                if not self._active:
+                    self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for thread_id, route in list(self._active.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                with self._lock:
+                    self._record(route).stacks[';'.join(reversed(stack))] += 1
+
+
+profiler = Profiler(PROFILE_SAMPLE_RATE, PROFILE_INTERVAL, PROFILE_WINDOW)
+
+
+def start_profile():
+    if request.path.startswith(ADMIN_PREFIX) or not profiler.should_sample():
+        return
+    route = endpoint_label()
+    profile = profiler.start(route)
+    if profile is not None:
+        g.profile = (route, profile)
+
+
+def stop_profile(exc):
+    active = g.pop('profile', None)
+    if active is not None:
+        profiler.stop(*active)
+
+
+def profile_index():
+    return jsonify(profiler.routes())
+
+
+def profile_collapsed():
+    return Response(profiler.collapsed(request.args.get('route')), mimetype='text/plain')
+
+
+def profile_pstats():
+    route = request.args.get('route')
+    if route is None:
+        abort(400, "route is required, see /admin/profile for the profiled routes")
+    stats = profiler.stats(route)
+    if stats is None:
+        abort(404, f"No profile recorded for route '{route}'")
+
+    if request.args.get('format') == 'raw':
+        # Same format as pstats.Stats.dump_stats, loadable with pstats or snakeviz
+        return Response(marshal.dumps(stats.stats), mimetype='application/octet-stream')
+    sort = request.args.get('sort', pstats.SortKey.CUMULATIVE.value)
+    if sort not in SORT_KEYS:
+        abort(400, f"Unknown sort '{sort}', expected one of {', '.join(SORT_KEYS)}")
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats(pstats.SortKey(sort)).print_stats(request.args.get('limit', 50, type=int))
+    return Response(out.getvalue(), mimetype='text/plain')
+
+
+def init_profiling(app):
+    """Opt-in per-route profiling of ``app``, with dumps served under /admin/profile.
+
+    Nothing is registered unless PROFILE_SAMPLE_RATE is above zero or
+    PROFILE_HEADER_ENABLED is set, so the default costs nothing.
+    """
+    if PROFILE_SAMPLE_RATE <= 0 and not PROFILE_HEADER_ENABLED:
+        return
+    app.before_request(start_profile)
+    app.teardown_request(stop_profile)
+    app.add_url_rule(ADMIN_PREFIX, 'profile_index', profile_index)
+    app.add_url_rule(f"{ADMIN_PREFIX}/collapsed", 'profile_collapsed', profile_collapsed)
+    app.add_url_rule(f"{ADMIN_PREFIX}/pstats", 'profile_pstats', profile_pstats)
@@ -1,39 +1,126 @@
-from flask import Blueprint
-import psycopg2
+from flask import Blueprint, Response, abort, request
+import io
+import os
 import random
 
+from app.cache import result_cache
+from app.db import get_db_connection, insert_values, warm_pool
+from app.statements import DELETE_BATCH, DELETE_ROW, INSERT_ROW, READ_ALL, READ_COUNT, statements
+
 data_api = Blueprint('data_api', __name__)
 
-def get_db_connection():
-    conn = psycopg2.connect(host='postgres-db-service',
-                            database='db',
-                            user='postgres',
-                            password='postgres_pass',
-                            port=5432)
-    return conn
+# Open the worker's pooled connections when the blueprint is registered
+data_api.record_once(lambda state: warm_pool())
+
+WRITE_ROWS = 2000
+DEFAULT_WRITE_MODE = os.environ.get('DATA_WRITE_MODE', 'copy')
+DEFAULT_READ_MODE = os.environ.get('DATA_READ_MODE', 'count')
+DEFAULT_READ_BATCH_SIZE = int(os.environ.get('DATA_READ_BATCH_SIZE', '2000'))
+
+def read_rows(conn, batch_size):
+    # Original behaviour: pull every row into the worker and count them here
+    with conn.cursor() as cur:
+        statements.execute(cur, READ_ALL)
+        return len(cur.fetchall())
+
+def read_count(conn, batch_size):
+    # Let the database do the aggregation and send back a single row
+    with conn.cursor() as cur:
+        statements.execute(cur, READ_COUNT)
+        return cur.fetchone()[0]
+
+def read_stream(conn, batch_size):
+    # Server-side cursor, so at most batch_size rows are held in the worker at once
+    count = 0
+    for rows in fetch_batches(conn, 'read_heavy_stream', batch_size):
+        count += len(rows)
+    return count
+
+def fetch_batches(conn, cursor_name, batch_size):
+    with conn.cursor(name=cursor_name) as cur:
+        cur.itersize = batch_size
+        cur.execute('SELECT * FROM read_heavy;')
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+def export_rows(batch_size):
+    # The pooled connection is held until the last chunk is sent or the client goes away
+    with get_db_connection() as conn:
+        for rows in fetch_batches(conn, 'read_heavy_export', batch_size):
+            yield ''.join(f"{row[0]}\n" for row in rows)
+
+READ_MODES = {
+    'rows': read_rows,
+    'count': read_count,
+    'stream': read_stream,
+}
+
+def write_per_row(cur, write_id, names):
+    # Original behaviour: one round trip per inserted and per deleted row
+    for name in names:
+        statements.execute(cur, INSERT_ROW, (write_id, name))
+    for name in names:
+        statements.execute(cur, DELETE_ROW, (write_id, name))
+
+def write_values(cur, write_id, names):
+    # One multi-row INSERT per page of rows, then a single set-based DELETE
+    insert_values(cur, "INSERT INTO write_heavy (write_id, write_name) VALUES %s",
+                  [(write_id, name) for name in names])
+    delete_batch(cur, write_id, names)
+
+def write_copy(cur, write_id, names):
+    # Stream the rows through COPY, then a single set-based DELETE
+    rows = io.StringIO(''.join(f"{write_id}\t{name}\n" for name in names))
+    cur.copy_expert("COPY write_heavy (write_id, write_name) FROM STDIN", rows)
+    delete_batch(cur, write_id, names)
+
+def delete_batch(cur, write_id, names):
+    statements.execute(cur, DELETE_BATCH, (write_id, list(names)))
+
+WRITE_MODES = {
+    'row': write_per_row,
+    'values': write_values,
+    'copy': write_copy,
+}
 
 @data_api.route('/dataapi/read')
 def test_read():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT * FROM read_heavy;')
-    books = cur.fetchall()
-    cur.close()
-    conn.close()
-    return f"{len(books)}"
+    mode = request.args.get('mode', DEFAULT_READ_MODE)
+    try:
+        batch_size = int(request.args.get('batch_size', DEFAULT_READ_BATCH_SIZE))
+    except ValueError:
+        abort(400, "batch_size must be a positive integer")
+    if batch_size <= 0:
+        abort(400, "batch_size must be a positive integer")
+
+    # Chunked response streaming every row out of a server-side cursor
+    if mode == 'export':
+        return Response(export_rows(batch_size), mimetype='text/plain')
+    if mode not in READ_MODES:
+        abort(400, f"Unknown read mode '{mode}', expected one of {', '.join(READ_MODES)}, export")
+
+    def load():
+        with get_db_connection() as conn:
+            return READ_MODES[mode](conn, batch_size)
+
+    count = result_cache.get_or_load(f"read:{mode}", ('read_heavy',), load)
+    return f"{count}"
 
 @data_api.route('/dataapi/write')
 def test_write():
-    conn = get_db_connection()
-    cur = conn.cursor()
+    mode = request.args.get('mode', DEFAULT_WRITE_MODE)
+    if mode not in WRITE_MODES:
+        abort(400, f"Unknown write mode '{mode}', expected one of {', '.join(WRITE_MODES)}")
+
     random_num = random.randint(1, 1000000)
-    changes = 0
-    for i in range(2000):
-        cur.execute(f"INSERT INTO write_heavy (write_id, write_name) VALUES ({random_num}, '{i}')")
-        changes += 1
-    for i in range(2000):
-        cur.execute(f"DELETE FROM write_heavy WHERE write_id={random_num} and write_name='{i}'")
-        changes += 1
-    cur.close()
-    conn.close()
+    names = [str(i) for i in range(WRITE_ROWS)]
+    with get_db_connection() as conn:
+        # All inserts and deletes of a request share one transaction
+        with conn, conn.cursor() as cur:
+            WRITE_MODES[mode](cur, random_num, names)
+    result_cache.invalidate('write_heavy')
+    changes = 2 * len(names)
     return f"Changes: {changes}"
\ No newline at end of file
@@ -2,6 +2,13 @@ from flask import Flask
 from app.apis.quick import quick_api
 from app.apis.compute import compute_api
 from app.apis.data import data_api
+from app.accounting import init_accounting
+from app.metrics import init_metrics
+from app.profiling import init_profiling
+from app.startup import init_startup, mark_phase
+from app.tracing import init_tracing
+
+mark_phase('imports')
 
 # Create the Flask app
 app = Flask(__name__)
@@ -11,10 +18,25 @@ app = Flask(__name__)
 def index():
     return 'Hello from app!'
 
-# Register the blueprints with the app
+# Register the blueprints with the app, before init_metrics binds their label children
 app.register_blueprint(quick_api)
 app.register_blueprint(compute_api)
 app.register_blueprint(data_api)
 
+# W3C trace context and per-request spans, see app/tracing.py
+init_tracing(app)
+
+# Middleware to collect metrics, served at /metrics
+init_metrics(app)
+
+# CPU, memory and invocations per route, served at /metrics/resources
+init_accounting(app)
+
+# Opt-in per-route profiling, see app/profiling.py
+init_profiling(app)
+
+# Cold-start timing and the X-Cold-Start header, see app/startup.py
+init_startup(app)
+
 if __name__ == '__main__':
     app.run()
\ No newline at end of file
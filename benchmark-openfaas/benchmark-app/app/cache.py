@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+try:
+    import redis
+except ImportError:  # the shared tier is optional
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Off unless DATA_CACHE_TTL is set, so read mode comparisons measure the database
+CACHE_TTL = float(os.environ.get('DATA_CACHE_TTL', '0'))
+CACHE_MAX_ENTRIES = int(os.environ.get('DATA_CACHE_MAX_ENTRIES', '256'))
+CACHE_REDIS_URL = os.environ.get('DATA_CACHE_REDIS_URL')
+
+CACHE_REQUESTS = Counter(
+    'data_cache_requests_total', 'Data api result cache lookups', ['tier', 'result']
+)
+CACHE_INVALIDATIONS = Counter(
+    'data_cache_invalidations_total', 'Data api result cache invalidations', ['table']
+)
+
+
+class LocalCache:
+    """In-process LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SharedCache:
+    """Redis tier shared by every replica, including the table generations."""
+
+    def __init__(self, url, ttl):
+        self.ttl = ttl
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key):
+        value = self.client.get(f"datacache:value:{key}")
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(f"datacache:value:{key}", json.dumps(value), px=int(self.ttl * 1000))
+
+    def generations(self, tables):
+        values = self.client.mget([f"datacache:gen:{table}" for table in tables])
+        return [int(value or 0) for value in values]
+
+    def bump(self, table):
+        self.client.incr(f"datacache:gen:{table}")
+
+
+class ResultCache:
+    """Read-through cache for data api query results.
+
+    Every key is tied to the tables its query reads. Writing to a table
+    bumps that table's generation, which retires all keys built from the
+    old generation. Without a shared tier the generations are per worker:
+    a write only invalidates the worker that served it, and the other
+    workers keep serving their cached result for up to ``ttl`` seconds.
+    With a shared tier configured the generations live in Redis, so a write
+    on one worker or replica invalidates all of them.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, redis_url=CACHE_REDIS_URL):
+        self.enabled = ttl > 0 and max_entries > 0
+        self.local = LocalCache(ttl, max_entries)
+        self.shared = None
+        self._generations = {}
+        if self.enabled and redis_url:
+            if redis is None:
+                logger.warning("DATA_CACHE_REDIS_URL is set but redis is not installed; using the local tier only")
+            else:
+                self.shared = SharedCache(redis_url, ttl)
+
+    def get_or_load(self, key, tables, loader):
+        if not self.enabled:
+            return loader()
+
+        full_key = f"{key}@{self._version(tables)}"
+        value = self.local.get(full_key)
+        if value is not None:
+            CACHE_REQUESTS.labels(tier='local', result='hit').inc()
+            return value
+        CACHE_REQUESTS.labels(tier='local', result='miss').inc()
+
+        if self.shared is not None:
+            value = self._shared_call(self.shared.get, full_key)
+            if value is not None:
+                CACHE_REQUESTS.labels(tier='shared', result='hit').inc()
+                self.local.set(full_key, value)
+                return value
+            CACHE_REQUESTS.labels(tier='shared', result='miss').inc()
+
+        value = loader()
+        self.local.set(full_key, value)
+        if self.shared is not None:
+            self._shared_call(self.shared.set, full_key, value)
+        return value
+
+    def invalidate(self, *tables):
+        for table in tables:
+            CACHE_INVALIDATIONS.labels(table=table).inc()
+            self._generations[table] = self._generations.get(table, 0) + 1
+            if self.shared is not None:
+                self._shared_call(self.shared.bump, table)
+
+    def _version(self, tables):
+        generations = [f"l{self._generations.get(table, 0)}" for table in tables]
+        if self.shared is not None:
+            shared = self._shared_call(self.shared.generations, tables)
+            if shared is not None:
+                generations = [f"s{gen}" for gen in shared]
+        return ':'.join(f"{table}={gen}" for table, gen in zip(tables, generations))
+
+    def _shared_call(self, fn, *args):
+        # A slow or missing Redis must never fail the request, only skip the shared tier
+        try:
+            return fn(*args)
+        except redis.RedisError as e:
+            logger.warning("Shared cache unavailable: %s", e)
+            return None
+
+
+result_cache = ResultCache()
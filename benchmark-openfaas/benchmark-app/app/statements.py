@@ -0,0 +1,69 @@
+import re
+
+from prometheus_client import Counter
+
+STATEMENT_PREPARES = Counter(
+    'data_statement_prepares_total', 'Data api statements prepared on a pooled connection', ['statement']
+)
+STATEMENT_REUSES = Counter(
+    'data_statement_reuses_total', 'Data api executions that reused an already prepared statement', ['statement']
+)
+
+_PARAM = re.compile(r"%s")
+
+
+class StatementRegistry:
+    """Hot data api queries, prepared once per pooled connection.
+
+    Statements are written with psycopg2 ``%s`` placeholders. On a
+    Postgres connection the first execution sends ``PREPARE`` and every
+    later one only ``EXECUTE``, so the server skips parsing and planning.
+    Connections without a ``prepared`` set (the SQLite backend) run the
+    SQL directly and rely on the driver's own statement cache.
+    """
+
+    def __init__(self):
+        self._statements = {}
+
+    def register(self, name, sql):
+        params = 0
+
+        def number(match):
+            nonlocal params
+            params += 1
+            return f"${params}"
+
+        # Counter children are bound here so execute() does not look up labels
+        self._statements[name] = (
+            sql, _PARAM.sub(number, sql), params,
+            STATEMENT_PREPARES.labels(statement=name), STATEMENT_REUSES.labels(statement=name),
+        )
+        return name
+
+    def execute(self, cur, name, params=()):
+        sql, prepared_sql, param_count, prepares, reuses = self._statements[name]
+        prepared = getattr(getattr(cur, 'connection', None), 'prepared', None)
+        if prepared is None:
+            cur.execute(sql, params)
+            return
+
+        if name in prepared:
+            reuses.inc()
+        else:
+            cur.execute(f"PREPARE {name} AS {prepared_sql}")
+            prepared.add(name)
+            prepares.inc()
+
+        if param_count:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * param_count)})", params)
+        else:
+            cur.execute(f"EXECUTE {name}")
+
+
+statements = StatementRegistry()
+
+READ_ALL = statements.register('read_all', "SELECT * FROM read_heavy")
+READ_COUNT = statements.register('read_count', "SELECT count(*) FROM read_heavy")
+INSERT_ROW = statements.register('insert_row', "INSERT INTO write_heavy (write_id, write_name) VALUES (%s, %s)")
+DELETE_ROW = statements.register('delete_row', "DELETE FROM write_heavy WHERE write_id = %s AND write_name = %s")
+DELETE_BATCH = statements.register('delete_batch', "DELETE FROM write_heavy WHERE write_id = %s AND write_name = ANY(%s)")
@@ -0,0 +1,227 @@
+import atexit
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import urllib.request
+
+from flask import g, request
+
+from app.metrics import endpoint_label, queue_seconds
+
+# none (default), file, otlp or memory; memory keeps spans in-process for tests
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'none')
+TRACE_FILE = os.environ.get('TRACE_FILE', '/tmp/demonfaas-spans.jsonl')
+OTLP_ENDPOINT = os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT', 'http://localhost:4318')
+SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', os.environ.get('OTEL_SERVICE_NAME', 'benchmark-app'))
+
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 2.0
+QUEUE_SIZE = 4096
+
+SPAN_KIND_SERVER = 2
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+def parse_traceparent(header):
+    """(trace_id, parent_span_id, flags) from a W3C ``traceparent``, or None."""
+    match = _TRACEPARENT.match(header.strip().lower()) if header else None
+    if match is None or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2), int(match.group(3), 16)
+
+
+def otlp_request(spans):
+    # ExportTraceServiceRequest in the OTLP/JSON encoding
+    def attribute(key, value):
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        if isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        if isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    return {'resourceSpans': [{
+        'resource': {'attributes': [attribute('service.name', SERVICE_NAME)]},
+        'scopeSpans': [{
+            'scope': {'name': 'demonfaas'},
+            'spans': [{
+                'traceId': span['trace_id'],
+                'spanId': span['span_id'],
+                'parentSpanId': span['parent_id'] or '',
+                'name': span['name'],
+                'kind': span['kind'],
+                'startTimeUnixNano': str(span['start']),
+                'endTimeUnixNano': str(span['end']),
+                'attributes': [attribute(key, value) for key, value in span['attributes'].items()],
+            } for span in spans],
+        }],
+    }]}
+
+
+class FileSpanExporter:
+    """Appends one OTLP/JSON export request per batch to a file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, spans):
+        line = json.dumps(otlp_request(spans), separators=(',', ':')) + '\n'
+        # A single append per batch keeps lines from different workers whole
+        with open(self.path, 'a') as f:
+            f.write(line)
+
+
+class OtlpSpanExporter:
+    """Posts batches to an OTLP/HTTP collector, e.g. the OpenTelemetry Collector or Jaeger."""
+
+    def __init__(self, endpoint, timeout=5):
+        self.url = endpoint.rstrip('/') + '/v1/traces'
+        self.timeout = timeout
+
+    def export(self, spans):
+        body = json.dumps(otlp_request(spans)).encode()
+        req = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=self.timeout):
+            pass
+
+
+class InMemorySpanExporter:
+    """Stub exporter that keeps finished spans, for tests and local debugging."""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+EXPORTERS = {
+    'file': lambda: FileSpanExporter(TRACE_FILE),
+    'otlp': lambda: OtlpSpanExporter(OTLP_ENDPOINT),
+    'memory': InMemorySpanExporter,
+}
+
+
+class SpanProcessor:
+    """Hands finished spans to ``exporter`` in batches from a background thread.
+
+    The queue is bounded; when the exporter cannot keep up spans are
+    dropped rather than slowing requests down.
+    """
+
+    def __init__(self, exporter, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, queue_size=QUEUE_SIZE):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def on_end(self, span):
+        if self.flush_interval == 0:
+            self.exporter.export([span])
+            return
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._thread is None:
+            self._start()
+
+    def flush(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) == self.batch_size:
+                self._export(batch)
+                batch = []
+        if batch:
+            self._export(batch)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                # Started lazily so a gunicorn worker gets its own thread after the fork
+                self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _export(self, batch):
+        try:
+            self.exporter.export(batch)
+        except Exception:
+            # A missing collector must never break request handling
+            self.dropped += len(batch)
+
+
+processor = None
+if TRACE_EXPORTER in EXPORTERS:
+    # The in-memory stub exports synchronously so spans are visible as soon as a request ends
+    processor = SpanProcessor(EXPORTERS[TRACE_EXPORTER](), flush_interval=0 if TRACE_EXPORTER == 'memory' else FLUSH_INTERVAL)
+
+
+def start_span():
+    parent = parse_traceparent(request.headers.get('traceparent'))
+    if parent is None:
+        trace_id, parent_id, flags = secrets.token_hex(16), None, 1
+    else:
+        trace_id, parent_id, flags = parent
+    g.trace = {'trace_id': trace_id, 'span_id': secrets.token_hex(8), 'parent_id': parent_id,
+               'flags': flags, 'start': time.time_ns()}
+
+
+def record_status(response):
+    trace = g.get('trace')
+    if trace is not None:
+        trace['status'] = response.status_code
+    return response
+
+
+def export_span(exc):
+    trace = g.pop('trace', None)
+    if trace is None or processor is None or not trace['flags'] & 1:
+        return
+    attributes = {'http.request.method': request.method, 'http.route': endpoint_label(),
+                  'http.response.status_code': trace.get('status', 500)}
+    header = request.headers.get('X-Request-Start')
+    if header:
+        # Time between the proxy forwarding the request and this worker picking it up,
+        # i.e. the gateway and watchdog hops
+        queued = queue_seconds(header, trace['start'])
+        if queued is not None:
+            attributes['demonfaas.queue_ms'] = round(queued * 1000, 3)
+    if exc is not None:
+        attributes['exception.type'] = type(exc).__name__
+    processor.on_end({
+        'trace_id': trace['trace_id'], 'span_id': trace['span_id'], 'parent_id': trace['parent_id'],
+        'name': f"{request.method} {endpoint_label()}", 'kind': SPAN_KIND_SERVER,
+        'start': trace['start'], 'end': time.time_ns(), 'attributes': attributes,
+    })
+
+
+def init_tracing(app):
+    """Continue the caller's W3C trace in ``app`` and export a server span per request.
+
+    Register before the other middleware so the span covers them. Spans
+    are only exported when TRACE_EXPORTER is file, otlp or memory, but
+    trace context is always propagated.
+    """
+    app.before_request(start_span)
+    app.after_request(record_status)
+    app.teardown_request(export_span)
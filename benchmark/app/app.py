@@ -1,4 +1,5 @@
 from flask import Flask
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from app.apis.quick import quick_api
 from app.apis.compute import compute_api
 from app.apis.data import data_api
@@ -11,6 +12,11 @@ app = Flask(__name__)
 def index():
     return 'Hello from app!'
 
+# Data api cache and statement counters, see app/cache.py and app/statements.py
+@app.route('/metrics')
+def metrics():
+    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
 # Register the blueprints with the app
 app.register_blueprint(quick_api)
 app.register_blueprint(compute_api)
@@ -0,0 +1,237 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import execute_values
+
+from app.db_sqlite import SQLiteBackend, SQLiteCursor
+
+logger = logging.getLogger(__name__)
+
+# Which database to use: 'postgres', or 'sqlite' to run without any outside services
+DB_BACKEND = os.environ.get('DB_BACKEND', 'postgres')
+DB_SQLITE_PATH = os.environ.get('DB_SQLITE_PATH', ':memory:')
+
+# Connection settings, overridable per deployment through the environment
+DB_SETTINGS = {
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'port': int(os.environ.get('DB_PORT', '5433')),
+    'database': os.environ.get('DB_NAME', 'db'),
+    'user': os.environ.get('DB_USER', 'postgres'),
+    'password': os.environ.get('DB_PASSWORD', 'postgres_pass'),
+    'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', '5')),
+}
+
+# Pool sizing and recycling, also read from the environment
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800'))
+POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+DB_ERRORS = (psycopg2.Error, sqlite3.Error)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PreparedConnection(extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Statements already prepared in this session, see app.statements
+        self.prepared = set()
+
+
+class PostgresBackend:
+    def connect(self):
+        return psycopg2.connect(connection_factory=PreparedConnection, **DB_SETTINGS)
+
+
+BACKENDS = {
+    'postgres': PostgresBackend,
+    'sqlite': lambda: SQLiteBackend(DB_SQLITE_PATH),
+}
+
+
+class _PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """Bounded pool of connections opened by ``connect``.
+
+    Idle connections are handed out most-recently-used first. A connection
+    is pinged before reuse once it has been idle longer than
+    ``health_check_interval`` and is replaced once it is older than
+    ``max_lifetime``.
+    """
+
+    def __init__(self, connect, min_size, max_size, max_lifetime, health_check_interval, timeout):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self._idle = []
+        self._in_use = {}
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def warm(self):
+        # Open min_size connections up front so the first requests skip the handshake
+        warmed = []
+        try:
+            while len(warmed) < self.min_size:
+                warmed.append(self.getconn())
+        finally:
+            for conn in warmed:
+                self.putconn(conn)
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    raise PoolTimeout(f"no connection available after {self.timeout}s")
+
+        try:
+            if pooled is not None:
+                pooled = self._check(pooled)
+            if pooled is None:
+                pooled = _PooledConnection(self.connect())
+        except Exception:
+            self._forget()
+            raise
+
+        pooled.last_used = time.monotonic()
+        self._in_use[id(pooled.conn)] = pooled
+        return pooled.conn
+
+    def putconn(self, conn, discard=False):
+        pooled = self._in_use.pop(id(conn), None)
+        if pooled is None:
+            return
+
+        if not discard and not conn.closed:
+            try:
+                # Never hand out a connection with an open transaction
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except DB_ERRORS:
+                discard = True
+
+        if discard or conn.closed or self._expired(pooled):
+            self._close(conn)
+            self._forget()
+            return
+
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            self._close(pooled.conn)
+
+    def _check(self, pooled):
+        if pooled.conn.closed or self._expired(pooled):
+            self._close(pooled.conn)
+            return None
+        if time.monotonic() - pooled.last_used >= self.health_check_interval:
+            try:
+                with pooled.conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                pooled.conn.rollback()
+            except DB_ERRORS:
+                logger.warning("Discarding pooled connection that failed its health check")
+                self._close(pooled.conn)
+                return None
+        return pooled
+
+    def _expired(self, pooled):
+        return time.monotonic() - pooled.created_at >= self.max_lifetime
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except DB_ERRORS:
+            pass
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # Pools are per worker process; a forked worker never reuses its parent's sockets
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                if DB_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown DB_BACKEND '{DB_BACKEND}', expected one of {', '.join(BACKENDS)}")
+                backend = BACKENDS[DB_BACKEND]()
+                _pool = ConnectionPool(backend.connect, POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_MAX_LIFETIME,
+                                       POOL_HEALTH_CHECK_INTERVAL, POOL_TIMEOUT)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def warm_pool():
+    try:
+        get_pool().warm()
+    except DB_ERRORS + (PoolTimeout,) as e:
+        # The database may not be reachable yet; requests will connect lazily
+        logger.warning("Could not pre-warm database pool: %s", e)
+
+
+@contextmanager
+def get_db_connection():
+    pool = get_pool()
+    conn = pool.getconn()
+    discard = False
+    try:
+        yield conn
+    except DB_ERRORS:
+        # Broken connections go back closed and are dropped from the pool
+        discard = bool(conn.closed)
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
+
+
+def insert_values(cur, sql, rows):
+    # Multi-row INSERT: a single statement on Postgres, an in-process executemany on SQLite
+    if isinstance(cur, SQLiteCursor):
+        cur.execute_values(sql, rows)
+    else:
+        execute_values(cur, sql, rows, page_size=max(len(rows), 1))
@@ -0,0 +1,179 @@
+import re
+import sqlite3
+import threading
+
+from psycopg2 import extensions
+
+# Same tables and rows as init.sql and insert.sql, in SQLite's dialect
+SEED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS read_heavy
+(
+    read_name varchar(50) not null
+);
+
+CREATE TABLE IF NOT EXISTS write_heavy
+(
+    write_id   int not null,
+    write_name varchar(50) not null
+);
+"""
+
+SEED_ROWS = """
+WITH RECURSIVE number_gen AS (
+    SELECT 1 AS num
+    UNION ALL
+    SELECT num + 1
+    FROM number_gen
+    WHERE num < 100000
+)
+INSERT INTO read_heavy (read_name)
+SELECT 'Name_' || num AS read_name
+FROM number_gen;
+"""
+
+_PLACEHOLDER = re.compile(r"= ANY\(%s\)|%s|%%")
+_COPY = re.compile(r"COPY\s+(\w+)\s*\(([^)]*)\)\s+FROM\s+STDIN", re.IGNORECASE)
+
+
+def translate(sql, params):
+    """Rewrite psycopg2 ``%s`` SQL into SQLite ``?`` SQL.
+
+    ``= ANY(%s)`` with a list parameter is expanded into ``IN (?, ...)``.
+    """
+    params = list(params or ())
+    out_params = []
+    index = 0
+
+    def replace(match):
+        nonlocal index
+        token = match.group(0)
+        if token == '%%':
+            return '%'
+        value = params[index]
+        index += 1
+        if token == '%s':
+            out_params.append(value)
+            return '?'
+        values = list(value)
+        out_params.extend(values)
+        return f"IN ({', '.join('?' * len(values))})" if values else "IN (NULL)"
+
+    return _PLACEHOLDER.sub(replace, sql), out_params
+
+
+class SQLiteCursor:
+    """The subset of a psycopg2 cursor the data api relies on."""
+
+    def __init__(self, conn):
+        self._cur = conn.cursor()
+        self.itersize = 2000
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, sql, params=None):
+        self._cur.execute(*translate(sql, params))
+
+    def execute_values(self, sql, rows):
+        # VALUES %s becomes one bound row, repeated in-process by executemany
+        rows = list(rows)
+        if rows:
+            self._cur.executemany(sql.replace('%s', f"({', '.join('?' * len(rows[0]))})"), rows)
+
+    def copy_expert(self, sql, file):
+        match = _COPY.match(sql.strip())
+        if match is None:
+            raise sqlite3.NotSupportedError(f"unsupported COPY statement: {sql}")
+        table, columns = match.group(1), match.group(2)
+        rows = [line.split('\t') for line in file.read().splitlines() if line]
+        placeholders = ', '.join('?' * len(columns.split(',')))
+        self._cur.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows)
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cur.fetchmany(self.itersize if size is None else size)
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def close(self):
+        self._cur.close()
+
+
+class SQLiteConnection:
+    """Wraps sqlite3 so the pool and the data routes can treat it like psycopg2.
+
+    Named (server-side) cursors map onto ordinary cursors, which SQLite
+    already steps through lazily.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.closed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Same as psycopg2: end the transaction but keep the connection open
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def cursor(self, name=None):
+        return SQLiteCursor(self._conn)
+
+    def get_transaction_status(self):
+        if self._conn.in_transaction:
+            return extensions.TRANSACTION_STATUS_INTRANS
+        return extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        if not self.closed:
+            self._conn.close()
+            self.closed = 1
+
+
+class SQLiteBackend:
+    """Embedded database used in place of Postgres for local runs and CI.
+
+    ``:memory:`` is shared by every connection of the worker and kept
+    alive by an anchor connection, so pool recycling never drops the data.
+    """
+
+    def __init__(self, path):
+        if path == ':memory:':
+            self.target, self.uri = 'file:demonfaas?mode=memory&cache=shared', True
+        else:
+            self.target, self.uri = path, False
+        self._anchor = None
+        self._seed_lock = threading.Lock()
+
+    def connect(self):
+        with self._seed_lock:
+            # Only the first connection of the worker seeds, the others wait for it
+            if self._anchor is None:
+                anchor = sqlite3.connect(self.target, uri=self.uri, check_same_thread=False)
+                self.seed(anchor)
+                self._anchor = anchor
+        return SQLiteConnection(sqlite3.connect(self.target, uri=self.uri, check_same_thread=False))
+
+    def seed(self, conn):
+        conn.executescript(SEED_SCHEMA)
+        # Check and insert in one write transaction, so workers sharing a database file seed it once
+        conn.execute('BEGIN IMMEDIATE')
+        if conn.execute('SELECT count(*) FROM read_heavy').fetchone()[0] == 0:
+            conn.execute(SEED_ROWS)
+        conn.commit()
@@ -0,0 +1,208 @@
+package main
+
+import (
+	"bufio"
+	"encoding/json"
+	"io"
+	"math/rand/v2"
+	"net/http"
+	"os"
+	"strconv"
+	"strings"
+	"time"
+
+	"github.com/prometheus/client_golang/prometheus"
+	ctrlmetrics "sigs.k8s.io/controller-runtime/pkg/metrics"
+)
+
+// Proxy counters are Prometheus metrics, served with the controller-runtime
+// metrics on the manager's metrics port, instead of prints on every request.
+// Individual requests go to a sampled access log written from a background
+// goroutine; a full buffer drops entries rather than blocking the proxy.
+
+const (
+	unmatchedRoute       = "<unmatched>"
+	accessLogQueueSize   = 8192
+	accessLogFlushEvery  = time.Second
+	defaultAccessLogRate = 0.01
+)
+
+var (
+	proxyRequests = prometheus.NewCounterVec(prometheus.CounterOpts{
+		Name: "demonfaas_proxy_requests_total",
+		Help: "Requests proxied, by spec route, target (serverless or serverful) and status class",
+	}, []string{"route", "target", "status_class"})
+	proxyColdStarts = prometheus.NewCounterVec(prometheus.CounterOpts{
+		Name: "demonfaas_proxy_cold_starts_total",
+		Help: "Serverless responses flagged X-Cold-Start by a freshly started function replica, by spec route",
+	}, []string{"route"})
+	proxyDuration = prometheus.NewHistogramVec(prometheus.HistogramOpts{
+		Name:    "demonfaas_proxy_request_duration_seconds",
+		Help:    "Time from the proxy receiving a request until the response was written",
+		Buckets: []float64{0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10},
+	}, []string{"route", "target"})
+	accessLogEntries = prometheus.NewCounterVec(prometheus.CounterOpts{
+		Name: "demonfaas_access_log_entries_total",
+		Help: "Sampled access log entries, by outcome (written or dropped)",
+	}, []string{"outcome"})
+
+	accessLog = newAccessLoggerFromEnv()
+)
+
+func init() {
+	ctrlmetrics.Registry.MustRegister(proxyRequests, proxyColdStarts, proxyDuration, accessLogEntries)
+}
+
+type accessEntry struct {
+	Time       time.Time `json:"time"`
+	Method     string    `json:"method"`
+	Path       string    `json:"path"`
+	Route      string    `json:"route"`
+	Target     string    `json:"target"`
+	Status     int       `json:"status"`
+	DurationMs float64   `json:"duration_ms"`
+	TraceID    string    `json:"trace_id,omitempty"`
+}
+
+// accessLogger writes sampled requests as JSON lines. The sample rate is
+// defaultRate unless the route has its own; 5xx responses are always logged.
+type accessLogger struct {
+	defaultRate float64
+	routeRates  map[string]float64
+	entries     chan accessEntry
+}
+
+func newAccessLogger(out io.Writer, defaultRate float64, routeRates map[string]float64) *accessLogger {
+	l := &accessLogger{defaultRate: defaultRate, routeRates: routeRates}
+	if out != nil {
+		l.entries = make(chan accessEntry, accessLogQueueSize)
+		go l.run(out)
+	}
+	return l
+}
+
+// newAccessLoggerFromEnv reads ACCESS_LOG (stdout, the default, a file path or
+// none), ACCESS_LOG_SAMPLE_RATE and ACCESS_LOG_ROUTE_RATES, e.g.
+// "/dataapi/read=1,/quickapi/test1=0.001"
+func newAccessLoggerFromEnv() *accessLogger {
+	var out io.Writer = os.Stdout
+	switch path := envOrDefault("ACCESS_LOG", "stdout"); path {
+	case "stdout":
+	case "none":
+		out = nil
+	default:
+		f, err := os.OpenFile(path, os.O_APPEND|os.O_CREATE|os.O_WRONLY, 0644)
+		if err != nil {
+			panic("unable to open access log: " + err.Error())
+		}
+		out = f
+	}
+	defaultRate := defaultAccessLogRate
+	if rate, err := strconv.ParseFloat(os.Getenv("ACCESS_LOG_SAMPLE_RATE"), 64); err == nil {
+		defaultRate = rate
+	}
+	return newAccessLogger(out, defaultRate, parseRouteRates(os.Getenv("ACCESS_LOG_ROUTE_RATES")))
+}
+
+func parseRouteRates(spec string) map[string]float64 {
+	rates := map[string]float64{}
+	for _, item := range strings.Split(spec, ",") {
+		route, value, ok := strings.Cut(strings.TrimSpace(item), "=")
+		if !ok {
+			continue
+		}
+		if rate, err := strconv.ParseFloat(value, 64); err == nil {
+			rates[route] = rate
+		}
+	}
+	return rates
+}
+
+func (l *accessLogger) sampled(route string, status int) bool {
+	if status >= 500 {
+		return true
+	}
+	rate, ok := l.routeRates[route]
+	if !ok {
+		rate = l.defaultRate
+	}
+	return rate >= 1 || (rate > 0 && rand.Float64() < rate)
+}
+
+func (l *accessLogger) enabled() bool {
+	return l.entries != nil
+}
+
+func (l *accessLogger) log(entry accessEntry) {
+	select {
+	case l.entries <- entry:
+	default:
+		accessLogEntries.WithLabelValues("dropped").Inc()
+	}
+}
+
+func (l *accessLogger) run(out io.Writer) {
+	w := bufio.NewWriter(out)
+	encoder := json.NewEncoder(w)
+	ticker := time.NewTicker(accessLogFlushEvery)
+	defer ticker.Stop()
+	written := accessLogEntries.WithLabelValues("written")
+	for {
+		select {
+		case entry := <-l.entries:
+			if err := encoder.Encode(entry); err != nil {
+				logger.Error(err, "Failed to write access log")
+				continue
+			}
+			written.Inc()
+		case <-ticker.C:
+			w.Flush()
+		}
+	}
+}
+
+// statusRecorder keeps the status code written by the reverse proxy
+type statusRecorder struct {
+	http.ResponseWriter
+	status int
+}
+
+func (s *statusRecorder) WriteHeader(code int) {
+	if s.status == 0 {
+		s.status = code
+	}
+	s.ResponseWriter.WriteHeader(code)
+}
+
+func (s *statusRecorder) Write(b []byte) (int, error) {
+	if s.status == 0 {
+		s.status = http.StatusOK
+	}
+	return s.ResponseWriter.Write(b)
+}
+
+// Unwrap lets http.ResponseController reach Flush on the real writer
+func (s *statusRecorder) Unwrap() http.ResponseWriter {
+	return s.ResponseWriter
+}
+
+// recordProxied counts a finished request and hands it to the access log
+func recordProxied(r *http.Request, route string, target string, status int, start time.Time) {
+	elapsed := time.Since(start)
+	if status == 0 {
+		status = http.StatusOK
+	}
+	proxyRequests.WithLabelValues(route, target, strconv.Itoa(status/100)+"xx").Inc()
+	proxyDuration.WithLabelValues(route, target).Observe(elapsed.Seconds())
+	if !accessLog.enabled() || !accessLog.sampled(route, status) {
+		return
+	}
+	entry := accessEntry{
+		Time: start, Method: r.Method, Path: r.URL.Path, Route: route, Target: target,
+		Status: status, DurationMs: float64(elapsed.Microseconds()) / 1000,
+	}
+	if sc, ok := parseTraceparent(r.Header.Get("traceparent")); ok {
+		entry.TraceID = sc.TraceID
+	}
+	accessLog.log(entry)
+}
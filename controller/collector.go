@@ -0,0 +1,320 @@
+package main
+
+import (
+	"context"
+	"errors"
+	"fmt"
+	"math"
+	"net/http"
+	"sync"
+	"time"
+
+	"github.com/prometheus/common/expfmt"
+)
+
+// The collector scrapes every serverful pod once per evaluation and indexes the
+// latency histograms by route, so every route of a reconcile reads the same
+// snapshot instead of fetching and parsing /metrics again. Scraping the pods
+// directly, rather than one random pod behind the Service, and merging their
+// histograms gives a fleet-wide latency. Routing decisions use the increase of
+// the histograms since the previous round, i.e. the latency of the last
+// evaluation interval rather than the average since each pod started.
+
+const (
+	latencyMetric         = "http_request_latency_seconds"
+	metricsScrapeTimeout  = 5 * time.Second
+	defaultScrapeWorkers  = 8
+	defaultMetricsService = "benchmark-app-service"
+	defaultMetricsPort    = 8080
+)
+
+type bucket struct {
+	UpperBound float64
+	Count      uint64
+}
+
+// routeHistogram is the cumulative latency histogram of one endpoint label,
+// summed over its methods
+type routeHistogram struct {
+	Count   uint64
+	Sum     float64
+	Buckets []bucket
+}
+
+func (h *routeHistogram) add(count uint64, sum float64, buckets []bucket) {
+	h.Count += count
+	h.Sum += sum
+	if h.Buckets == nil {
+		h.Buckets = append([]bucket(nil), buckets...)
+		return
+	}
+	for i := range h.Buckets {
+		if i < len(buckets) && buckets[i].UpperBound == h.Buckets[i].UpperBound {
+			h.Buckets[i].Count += buckets[i].Count
+		}
+	}
+}
+
+// since is the part of h observed after prev was scraped. Counts that went
+// down mean the pod restarted, and then everything in h is new.
+func (h *routeHistogram) since(prev *routeHistogram) *routeHistogram {
+	if prev == nil || h.reset(prev) {
+		return h
+	}
+	delta := &routeHistogram{Count: h.Count - prev.Count, Sum: h.Sum - prev.Sum, Buckets: make([]bucket, len(h.Buckets))}
+	for i, b := range h.Buckets {
+		delta.Buckets[i] = bucket{UpperBound: b.UpperBound, Count: b.Count - prev.Buckets[i].Count}
+	}
+	return delta
+}
+
+func (h *routeHistogram) reset(prev *routeHistogram) bool {
+	if h.Count < prev.Count || h.Sum < prev.Sum || len(h.Buckets) != len(prev.Buckets) {
+		return true
+	}
+	for i, b := range h.Buckets {
+		if b.UpperBound != prev.Buckets[i].UpperBound || b.Count < prev.Buckets[i].Count {
+			return true
+		}
+	}
+	return false
+}
+
+func (h *routeHistogram) mean() (float64, bool) {
+	if h == nil || h.Count == 0 {
+		return 0, false
+	}
+	return h.Sum / float64(h.Count), true
+}
+
+// quantile estimates the q-quantile (0 < q < 1) by linear interpolation within
+// the bucket that holds it, like PromQL's histogram_quantile. Past the last
+// finite bucket it returns that bucket's bound.
+func (h *routeHistogram) quantile(q float64) (float64, bool) {
+	if h == nil || h.Count == 0 || len(h.Buckets) == 0 {
+		return 0, false
+	}
+	rank := q * float64(h.Count)
+	lower, below := 0.0, uint64(0)
+	for _, b := range h.Buckets {
+		if float64(b.Count) >= rank {
+			if math.IsInf(b.UpperBound, 1) {
+				return lower, true
+			}
+			if b.Count == below {
+				return b.UpperBound, true
+			}
+			return lower + (b.UpperBound-lower)*(rank-float64(below))/float64(b.Count-below), true
+		}
+		lower, below = b.UpperBound, b.Count
+	}
+	return lower, true
+}
+
+// statistic is the latency named by spec.latencyStatistic: mean, p50, p95 or p99
+func (h *routeHistogram) statistic(name string) (float64, bool) {
+	switch name {
+	case "p50":
+		return h.quantile(0.5)
+	case "p95":
+		return h.quantile(0.95)
+	case "p99":
+		return h.quantile(0.99)
+	default:
+		return h.mean()
+	}
+}
+
+// metricsSnapshot is one round of scrapes. Targets holds the histograms of
+// each scraped pod by endpoint label. Window is the sum of their increase since
+// the previous round, which started at WindowStart; it is nil for the first
+// round.
+type metricsSnapshot struct {
+	Time        time.Time
+	Targets     map[string]map[string]*routeHistogram
+	Window      map[string]*routeHistogram
+	WindowStart time.Time
+}
+
+// windowRoute is the histogram of path over the last evaluation interval;
+// endpoint labels are Flask rules such as /computeapi/sieve/<limit>
+func (s *metricsSnapshot) windowRoute(path string) *routeHistogram {
+	if s == nil {
+		return nil
+	}
+	return findRoute(s.Window, path)
+}
+
+// window sums the increase of every pod's histograms since prev. Pods that
+// were not scraped in prev, e.g. new replicas, only count from the next round.
+func (s *metricsSnapshot) window(prev *metricsSnapshot) {
+	s.Window = map[string]*routeHistogram{}
+	s.WindowStart = prev.Time
+	for target, routes := range s.Targets {
+		prevRoutes, ok := prev.Targets[target]
+		if !ok {
+			continue
+		}
+		for endpoint, h := range routes {
+			delta := h.since(prevRoutes[endpoint])
+			merged, ok := s.Window[endpoint]
+			if !ok {
+				merged = &routeHistogram{}
+				s.Window[endpoint] = merged
+			}
+			merged.add(delta.Count, delta.Sum, delta.Buckets)
+		}
+	}
+}
+
+func findRoute(routes map[string]*routeHistogram, path string) *routeHistogram {
+	if h, ok := routes[path]; ok {
+		return h
+	}
+	for template, h := range routes {
+		if routeMatches(template, path) {
+			return h
+		}
+	}
+	return nil
+}
+
+// scrapeTargets lists the URLs to scrape, see discovery.go
+type scrapeTargets func(ctx context.Context) ([]string, error)
+
+type metricsCollector struct {
+	targets scrapeTargets
+	workers int
+	client  *http.Client
+
+	mu   sync.Mutex
+	last *metricsSnapshot
+}
+
+func newMetricsCollector(targets scrapeTargets, workers int) *metricsCollector {
+	if workers < 1 {
+		workers = 1
+	}
+	return &metricsCollector{targets: targets, workers: workers, client: &http.Client{Timeout: metricsScrapeTimeout}}
+}
+
+// Collect returns a snapshot no older than maxAge, scraping only when the last
+// one has expired. Concurrent reconciles share a single round of scrapes.
+func (c *metricsCollector) Collect(ctx context.Context, maxAge time.Duration) (*metricsSnapshot, error) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	if c.last != nil && time.Since(c.last.Time) < maxAge {
+		return c.last, nil
+	}
+	snapshot, err := c.collect(ctx)
+	if snapshot == nil {
+		return c.last, err
+	}
+	if c.last != nil {
+		snapshot.window(c.last)
+	}
+	c.last = snapshot
+	return snapshot, err
+}
+
+// collect scrapes every target with at most c.workers requests in flight. Pods
+// that fail are left out of the snapshot; it is only nil when all of them did.
+func (c *metricsCollector) collect(ctx context.Context) (*metricsSnapshot, error) {
+	urls, err := c.targets(ctx)
+	if err != nil {
+		return nil, err
+	}
+	if len(urls) == 0 {
+		return nil, errors.New("no metrics targets found")
+	}
+
+	type result struct {
+		url    string
+		routes map[string]*routeHistogram
+		err    error
+	}
+	jobs := make(chan string)
+	results := make(chan result, len(urls))
+	var wg sync.WaitGroup
+	for i := 0; i < c.workers && i < len(urls); i++ {
+		wg.Add(1)
+		go func() {
+			defer wg.Done()
+			for url := range jobs {
+				routes, err := c.scrape(ctx, url)
+				results <- result{url: url, routes: routes, err: err}
+			}
+		}()
+	}
+	for _, url := range urls {
+		jobs <- url
+	}
+	close(jobs)
+	wg.Wait()
+	close(results)
+
+	snapshot := &metricsSnapshot{Time: time.Now(), Targets: map[string]map[string]*routeHistogram{}}
+	var errs []error
+	for res := range results {
+		if res.err != nil {
+			errs = append(errs, res.err)
+			continue
+		}
+		snapshot.Targets[res.url] = res.routes
+	}
+	if len(snapshot.Targets) == 0 {
+		return nil, errors.Join(errs...)
+	}
+	return snapshot, errors.Join(errs...)
+}
+
+// scrape fetches one pod's /metrics and indexes its latency histograms
+func (c *metricsCollector) scrape(ctx context.Context, url string) (map[string]*routeHistogram, error) {
+	req, err := http.NewRequestWithContext(ctx, http.MethodGet, url, nil)
+	if err != nil {
+		return nil, err
+	}
+	resp, err := c.client.Do(req)
+	if err != nil {
+		return nil, err
+	}
+	defer resp.Body.Close()
+	if resp.StatusCode != http.StatusOK {
+		return nil, fmt.Errorf("scraping %s returned %s", url, resp.Status)
+	}
+
+	var parser expfmt.TextParser
+	families, err := parser.TextToMetricFamilies(resp.Body)
+	if err != nil {
+		return nil, fmt.Errorf("parsing %s: %w", url, err)
+	}
+
+	routes := map[string]*routeHistogram{}
+	family, ok := families[latencyMetric]
+	if !ok {
+		return routes, nil
+	}
+	for _, m := range family.GetMetric() {
+		hist := m.GetHistogram()
+		if hist == nil {
+			continue
+		}
+		var endpoint string
+		for _, label := range m.GetLabel() {
+			if label.GetName() == "endpoint" {
+				endpoint = label.GetValue()
+			}
+		}
+		buckets := make([]bucket, 0, len(hist.GetBucket()))
+		for _, b := range hist.GetBucket() {
+			buckets = append(buckets, bucket{UpperBound: b.GetUpperBound(), Count: b.GetCumulativeCount()})
+		}
+		h, ok := routes[endpoint]
+		if !ok {
+			h = &routeHistogram{}
+			routes[endpoint] = h
+		}
+		h.add(hist.GetSampleCount(), hist.GetSampleSum(), buckets)
+	}
+	return routes, nil
+}
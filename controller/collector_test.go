@@ -0,0 +1,282 @@
+package main
+
+import (
+	"context"
+	"fmt"
+	"math"
+	"net/http"
+	"net/http/httptest"
+	"strings"
+	"sync"
+	"testing"
+	"time"
+)
+
+var testBounds = []float64{0.1, 0.5, 1, math.Inf(1)}
+
+// histogram builds a cumulative histogram over testBounds from per-bucket counts
+func histogram(sum float64, counts ...uint64) *routeHistogram {
+	h := &routeHistogram{Sum: sum}
+	for i, bound := range testBounds {
+		if i < len(counts) {
+			h.Count += counts[i]
+		}
+		h.Buckets = append(h.Buckets, bucket{UpperBound: bound, Count: h.Count})
+	}
+	return h
+}
+
+func snapshotAt(seconds int64, targets map[string]map[string]*routeHistogram) *metricsSnapshot {
+	return &metricsSnapshot{Time: time.Unix(seconds, 0), Targets: targets}
+}
+
+func assertHistogram(t *testing.T, name string, got *routeHistogram, want *routeHistogram) {
+	t.Helper()
+	if got == nil {
+		t.Fatalf("%s: no histogram", name)
+	}
+	if got.Count != want.Count || math.Abs(got.Sum-want.Sum) > 1e-9 || len(got.Buckets) != len(want.Buckets) {
+		t.Fatalf("%s: got count %d sum %v, want count %d sum %v", name, got.Count, got.Sum, want.Count, want.Sum)
+	}
+	for i := range want.Buckets {
+		if got.Buckets[i] != want.Buckets[i] {
+			t.Fatalf("%s: bucket %d is %+v, want %+v", name, i, got.Buckets[i], want.Buckets[i])
+		}
+	}
+}
+
+func TestWindowIsTheIncreaseSinceThePreviousScrape(t *testing.T) {
+	prev := snapshotAt(0, map[string]map[string]*routeHistogram{
+		"pod-a": {"/quickapi/test1": histogram(2, 80, 15, 5)},
+	})
+	cur := snapshotAt(30, map[string]map[string]*routeHistogram{
+		"pod-a": {"/quickapi/test1": histogram(5, 90, 25, 10, 1)},
+	})
+	cur.window(prev)
+
+	if !cur.WindowStart.Equal(prev.Time) {
+		t.Errorf("window starts at %v, want %v", cur.WindowStart, prev.Time)
+	}
+	assertHistogram(t, "delta", cur.windowRoute("/quickapi/test1"), histogram(3, 10, 10, 5, 1))
+}
+
+func TestWindowSumsPods(t *testing.T) {
+	prev := snapshotAt(0, map[string]map[string]*routeHistogram{
+		"pod-a": {"/quickapi/test1": histogram(1, 10)},
+		"pod-b": {"/quickapi/test1": histogram(1, 10)},
+	})
+	cur := snapshotAt(30, map[string]map[string]*routeHistogram{
+		"pod-a": {"/quickapi/test1": histogram(2, 20)},
+		"pod-b": {"/quickapi/test1": histogram(4, 10, 5)},
+	})
+	cur.window(prev)
+
+	assertHistogram(t, "sum", cur.windowRoute("/quickapi/test1"), histogram(4, 10, 5))
+}
+
+func TestWindowAfterCounterReset(t *testing.T) {
+	for name, restarted := range map[string]*routeHistogram{
+		// The restarted pod has served fewer requests than before
+		"lower count": histogram(0.5, 5),
+		// Same count, but fewer in the fastest bucket
+		"lower bucket": histogram(20, 70, 30),
+		// Same counts, but a smaller sum
+		"lower sum": histogram(1, 90, 10),
+	} {
+		prev := snapshotAt(0, map[string]map[string]*routeHistogram{
+			"pod-a": {"/quickapi/test1": histogram(10, 90, 10)},
+		})
+		cur := snapshotAt(30, map[string]map[string]*routeHistogram{
+			"pod-a": {"/quickapi/test1": restarted},
+		})
+		cur.window(prev)
+
+		// Everything the restarted pod counted is new
+		assertHistogram(t, name, cur.windowRoute("/quickapi/test1"), restarted)
+	}
+}
+
+func TestWindowPodsComingAndGoing(t *testing.T) {
+	first := snapshotAt(0, map[string]map[string]*routeHistogram{
+		"pod-a": {"/quickapi/test1": histogram(1, 10)},
+		"pod-b": {"/quickapi/test1": histogram(1, 10)},
+	})
+	// pod-b is gone, pod-c is new and already served requests before its first scrape
+	second := snapshotAt(30, map[string]map[string]*routeHistogram{
+		"pod-a": {"/quickapi/test1": histogram(2, 20)},
+		"pod-c": {"/quickapi/test1": histogram(50, 0, 0, 50)},
+	})
+	second.window(first)
+	assertHistogram(t, "second", second.windowRoute("/quickapi/test1"), histogram(1, 10))
+
+	// From its second scrape on, pod-c counts
+	third := snapshotAt(60, map[string]map[string]*routeHistogram{
+		"pod-a": {"/quickapi/test1": histogram(3, 30)},
+		"pod-c": {"/quickapi/test1": histogram(52, 0, 2, 52)},
+	})
+	third.window(second)
+	assertHistogram(t, "third", third.windowRoute("/quickapi/test1"), histogram(3, 10, 2, 2))
+}
+
+func TestWindowNewRouteOnKnownPod(t *testing.T) {
+	prev := snapshotAt(0, map[string]map[string]*routeHistogram{
+		"pod-a": {"/quickapi/test1": histogram(1, 10)},
+	})
+	cur := snapshotAt(30, map[string]map[string]*routeHistogram{
+		"pod-a": {"/quickapi/test1": histogram(1, 10), "/dataapi/read": histogram(1, 0, 4)},
+	})
+	cur.window(prev)
+
+	// A route first served in this interval counts in full; an idle one is empty
+	assertHistogram(t, "new route", cur.windowRoute("/dataapi/read"), histogram(1, 0, 4))
+	assertHistogram(t, "idle route", cur.windowRoute("/quickapi/test1"), histogram(0))
+	if _, ok := cur.windowRoute("/quickapi/test1").mean(); ok {
+		t.Error("an idle route has a mean latency")
+	}
+}
+
+func TestWindowRouteMatchesTemplates(t *testing.T) {
+	sieve, files := histogram(1, 1), histogram(2, 2)
+	s := &metricsSnapshot{Window: map[string]*routeHistogram{
+		"/computeapi/sieve/<int:limit>": sieve,
+		"/files/<path:name>":            files,
+	}}
+	for _, tc := range []struct {
+		path string
+		want *routeHistogram
+	}{
+		{"/computeapi/sieve/<int:limit>", sieve},
+		{"/computeapi/sieve/1000", sieve},
+		{"/computeapi/sieve/", nil},
+		{"/computeapi/sieve/1000/extra", nil},
+		{"/computeapi/primes/1000", nil},
+		{"/files/a/b/c.txt", files},
+		{"/files/", nil},
+		{"/quickapi/test1", nil},
+	} {
+		if got := s.windowRoute(tc.path); got != tc.want {
+			t.Errorf("windowRoute(%q) = %v, want %v", tc.path, got, tc.want)
+		}
+	}
+
+	var first *metricsSnapshot
+	if first.windowRoute("/quickapi/test1") != nil {
+		t.Error("a nil snapshot has a window")
+	}
+}
+
+// fakePod serves its histograms in the text format of the apps' /metrics
+type fakePod struct {
+	mu     sync.Mutex
+	routes map[string]*routeHistogram
+}
+
+func (p *fakePod) set(endpoint string, h *routeHistogram) {
+	p.mu.Lock()
+	defer p.mu.Unlock()
+	p.routes[endpoint] = h
+}
+
+func (p *fakePod) ServeHTTP(w http.ResponseWriter, r *http.Request) {
+	p.mu.Lock()
+	defer p.mu.Unlock()
+	var b strings.Builder
+	b.WriteString("# HELP http_request_latency_seconds Latency of HTTP requests in seconds\n")
+	b.WriteString("# TYPE http_request_latency_seconds histogram\n")
+	for endpoint, h := range p.routes {
+		for _, bucket := range h.Buckets {
+			le := fmt.Sprint(bucket.UpperBound)
+			if math.IsInf(bucket.UpperBound, 1) {
+				le = "+Inf"
+			}
+			fmt.Fprintf(&b, "http_request_latency_seconds_bucket{endpoint=%q,le=%q,method=\"GET\"} %d.0\n", endpoint, le, bucket.Count)
+		}
+		fmt.Fprintf(&b, "http_request_latency_seconds_count{endpoint=%q,method=\"GET\"} %d.0\n", endpoint, h.Count)
+		fmt.Fprintf(&b, "http_request_latency_seconds_sum{endpoint=%q,method=\"GET\"} %v\n", endpoint, h.Sum)
+	}
+	w.Write([]byte(b.String()))
+}
+
+func TestCollectWindowsAcrossScrapes(t *testing.T) {
+	podA := &fakePod{routes: map[string]*routeHistogram{"/quickapi/test1": histogram(1, 10)}}
+	podB := &fakePod{routes: map[string]*routeHistogram{"/quickapi/test1": histogram(1, 10)}}
+	serverA, serverB := httptest.NewServer(podA), httptest.NewServer(podB)
+	defer serverA.Close()
+	defer serverB.Close()
+	collector := newMetricsCollector(func(ctx context.Context) ([]string, error) {
+		return []string{serverA.URL, serverB.URL}, nil
+	}, 2)
+	ctx := context.Background()
+
+	first, err := collector.Collect(ctx, 0)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if first.Window != nil {
+		t.Fatal("the first round has nothing to compare against")
+	}
+	if again, _ := collector.Collect(ctx, time.Minute); again != first {
+		t.Fatal("a fresh snapshot was scraped again")
+	}
+
+	// pod-a serves 10 more requests, pod-b restarts and has served 3 since
+	podA.set("/quickapi/test1", histogram(3, 10, 10))
+	podB.set("/quickapi/test1", histogram(0.5, 3))
+	second, err := collector.Collect(ctx, 0)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if !second.WindowStart.Equal(first.Time) {
+		t.Errorf("window starts at %v, want %v", second.WindowStart, first.Time)
+	}
+	assertHistogram(t, "window", second.windowRoute("/quickapi/test1"), histogram(2.5, 3, 10))
+}
+
+func TestQuantile(t *testing.T) {
+	for _, tc := range []struct {
+		name string
+		h    *routeHistogram
+		q    float64
+		want float64
+		ok   bool
+	}{
+		{"nil window", nil, 0.95, 0, false},
+		{"empty window", histogram(0), 0.95, 0, false},
+		{"no buckets", &routeHistogram{Count: 10, Sum: 1}, 0.5, 0, false},
+		{"first bucket", histogram(1, 100), 0.5, 0.05, true},
+		{"first bucket upper bound", histogram(1, 100), 1, 0.1, true},
+		{"bucket boundary", histogram(20, 50, 40, 9, 1), 0.5, 0.1, true},
+		{"interpolated", histogram(20, 50, 40, 9, 1), 0.95, 0.5 + 0.5*5/9, true},
+		{"top of last finite bucket", histogram(20, 50, 40, 9, 1), 0.99, 1, true},
+		{"in the +Inf bucket", histogram(20, 50, 40, 9, 1), 0.999, 1, true},
+		{"everything past the last bound", histogram(50, 0, 0, 0, 10), 0.5, 1, true},
+		{"empty buckets below", histogram(5, 0, 10), 0.5, 0.1 + 0.4*5/10, true},
+	} {
+		got, ok := tc.h.quantile(tc.q)
+		if ok != tc.ok || math.Abs(got-tc.want) > 1e-9 {
+			t.Errorf("%s: quantile(%v) = %v, %v; want %v, %v", tc.name, tc.q, got, ok, tc.want, tc.ok)
+		}
+	}
+}
+
+func TestStatistic(t *testing.T) {
+	h := histogram(20, 50, 40, 9, 1)
+	for _, tc := range []struct {
+		name string
+		want float64
+	}{
+		{"mean", 0.2},
+		{"", 0.2},
+		{"p50", 0.1},
+		{"p95", 0.5 + 0.5*5/9},
+		{"p99", 1},
+	} {
+		if got, ok := h.statistic(tc.name); !ok || math.Abs(got-tc.want) > 1e-9 {
+			t.Errorf("statistic(%q) = %v, %v; want %v", tc.name, got, ok, tc.want)
+		}
+	}
+	var idle *routeHistogram
+	if _, ok := idle.statistic("p95"); ok {
+		t.Error("an idle route has a p95")
+	}
+}
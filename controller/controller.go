@@ -1,25 +1,26 @@
 package main
 
 import (
-	"bytes"
 	"context"
 	"fmt"
-	"io/ioutil"
 	"math/rand/v2"
 	"net/http"
-	"net/http/httputil"
-	"net/url"
+	"sort"
+	"strings"
 	"sync"
+	"sync/atomic"
 	"time"
 
-	"github.com/prometheus/common/expfmt"
+	discoveryv1 "k8s.io/api/discovery/v1"
 	metav1 "k8s.io/apimachinery/pkg/apis/meta/v1"
 	"k8s.io/apimachinery/pkg/runtime"
 	"k8s.io/apimachinery/pkg/runtime/schema"
 	ctrl "sigs.k8s.io/controller-runtime"
+	"sigs.k8s.io/controller-runtime/pkg/builder"
 	"sigs.k8s.io/controller-runtime/pkg/client"
 	"sigs.k8s.io/controller-runtime/pkg/log"
 	"sigs.k8s.io/controller-runtime/pkg/log/zap"
+	"sigs.k8s.io/controller-runtime/pkg/predicate"
 	"sigs.k8s.io/controller-runtime/pkg/scheme"
 )
 
@@ -28,10 +29,12 @@ var (
 	routingCache      = &sync.Map{}
 	serverlessApiBase = ""
 	serverfulApiBase  = ""
-	countServerless   = 0
-	countServerful    = 0
 	routingMap        = &sync.Map{}
-	route_averages    = &sync.Map{}
+	routePolicies     = &sync.Map{}
+	routeRequests     = &sync.Map{}
+	coldStarts        = &sync.Map{}
+	traces            = newTracerFromEnv()
+	proxies           = newBackendProxies(newBackendTransport())
 )
 
 // GroupVersion is group version used to register these objects
@@ -80,7 +83,7 @@ func (avg *latencyAverages) updateAverages(latency float64) {
 	}
 
 	if len(avg.fastWindow) > avg.fastMovingAverageWindowSize {
-		avg.fastAverage -= (avg.fastWindow[0] / float64(avg.slowMovingAverageWindowSize))
+		avg.fastAverage -= (avg.fastWindow[0] / float64(avg.fastMovingAverageWindowSize))
 		avg.fastWindow = avg.fastWindow[1:]
 	}
 	// fmt.Printf("#3 slow window %.4f, fast window: %.4f\n", avg.slowAverage, avg.fastAverage)
@@ -130,6 +133,12 @@ func (in *ApiTransformation) DeepCopyInto(out *ApiTransformation) {
 	out.TypeMeta = in.TypeMeta
 	in.ObjectMeta.DeepCopyInto(&out.ObjectMeta)
 	out.Spec = in.Spec
+	if in.Spec.RoutingPolicyParameters != nil {
+		out.Spec.RoutingPolicyParameters = make(map[string]float64, len(in.Spec.RoutingPolicyParameters))
+		for key, value := range in.Spec.RoutingPolicyParameters {
+			out.Spec.RoutingPolicyParameters[key] = value
+		}
+	}
 	in.Status.DeepCopyInto(&out.Status)
 }
 
@@ -194,6 +203,11 @@ type ApiTransformationSpec struct {
 	slowMovingAverageWindowSize int                      `json:"slowMovingAverageWindowSize"`
 	fastMovingAverageWindowSize int                      `json:"fastMovingAverageWindowSize"`
 	Routes                      []ApiTransformationRoute `json:"routes"`
+	// Latency compared with LatencyThreshold: mean (the default), p50, p95 or p99
+	LatencyStatistic string `json:"latencyStatistic,omitempty"`
+	// threshold (the default), ewma, pid or cost, see policy.go
+	RoutingPolicy           string             `json:"routingPolicy,omitempty"`
+	RoutingPolicyParameters map[string]float64 `json:"routingPolicyParameters,omitempty"`
 }
 
 type ApiTransformationRoute struct {
@@ -202,9 +216,21 @@ type ApiTransformationRoute struct {
 }
 
 type ApiTransformationStatus struct {
-	CurrentTarget  string      `json:"currentTarget"`
-	LastUpdateTime metav1.Time `json:"lastUpdateTime"`
-	CurrentMetrics Metrics     `json:"currentMetrics"`
+	CurrentTarget    string                         `json:"currentTarget"`
+	LastUpdateTime   metav1.Time                    `json:"lastUpdateTime"`
+	CurrentMetrics   Metrics                        `json:"currentMetrics"`
+	LatencyStatistic string                         `json:"latencyStatistic,omitempty"`
+	RoutingPolicy    string                         `json:"routingPolicy,omitempty"`
+	Routes           []ApiTransformationRouteStatus `json:"routes,omitempty"`
+}
+
+// ApiTransformationRouteStatus is the split of one route and the latency that decided it
+type ApiTransformationRouteStatus struct {
+	Route               string  `json:"route"`
+	Latency             float64 `json:"latency"`
+	Requests            int64   `json:"requests"`
+	ColdStarts          int64   `json:"coldStarts"`
+	ServerfulPercentage float64 `json:"serverfulPercentage"`
 }
 
 // DeepCopyInto copies all properties of this object into another object of the same type
@@ -212,6 +238,9 @@ func (in *ApiTransformationStatus) DeepCopyInto(out *ApiTransformationStatus) {
 	*out = *in
 	in.LastUpdateTime.DeepCopyInto(&out.LastUpdateTime)
 	out.CurrentMetrics = in.CurrentMetrics
+	if in.Routes != nil {
+		out.Routes = append([]ApiTransformationRouteStatus(nil), in.Routes...)
+	}
 }
 
 type Metrics struct {
@@ -234,57 +263,17 @@ type PrometheusResponse struct {
 
 type ApiTransformationReconciler struct {
 	client.Client
-	Scheme *runtime.Scheme
-}
-
-func (r *ApiTransformationReconciler) getMetrics(ctx context.Context, apiPath string) (*Metrics, error) {
-	metrics := &Metrics{}
-
-	// Query request rate
-	requestRateQuery := fmt.Sprintf(`rate(http_requests_total{path="%s"}[5m])`, apiPath)
-	if requestRate, err := queryPrometheusMetric(requestRateQuery); err == nil {
-		metrics.RequestRate = requestRate
-	}
-
-	// Query latency
-	latencyQuery := fmt.Sprintf(`rate(http_request_duration_seconds_sum{path="%s"}[5m]) / rate(http_request_duration_seconds_count{path="%s"}[5m])`, apiPath, apiPath)
-	if latency, err := queryPrometheusMetric(latencyQuery); err == nil {
-		metrics.AvgLatency = latency
-	}
-
-	// Query error rate
-	errorRateQuery := fmt.Sprintf(`rate(http_requests_total{path="%s",status=~"5.."}[5m]) / rate(http_requests_total{path="%s"}[5m])`, apiPath, apiPath)
-	if errorRate, err := queryPrometheusMetric(errorRateQuery); err == nil {
-		metrics.ErrorRate = errorRate
-	}
-
-	// Query CPU utilization
-	cpuQuery := fmt.Sprintf(`sum(rate(container_cpu_usage_seconds_total{container=~"%s"}[5m])) / sum(container_spec_cpu_quota{container=~"%s"}) * 100`, apiPath, apiPath)
-	if cpuUtil, err := queryPrometheusMetric(cpuQuery); err == nil {
-		metrics.CPUUtilization = cpuUtil
-	}
-
-	return metrics, nil
-}
-
-func (r *ApiTransformationReconciler) shouldUseServerless(metrics *Metrics, spec *ApiTransformationSpec) bool {
-	// Decision logic based on multiple factors
-	if metrics.RequestRate > float64(spec.RequestThreshold) {
-		return true
-	}
-	if metrics.AvgLatency > spec.LatencyThreshold {
-		return false
-	}
-	if metrics.CPUUtilization > 80 { // High CPU utilization on serverful
-		return true
-	}
-	return false
+	Scheme    *runtime.Scheme
+	Collector *metricsCollector
+	// Window the routes were last updated from, so a reused snapshot is not counted twice
+	evaluated time.Time
 }
 
 // SetupWithManager sets up the controller with the Manager
 func (r *ApiTransformationReconciler) SetupWithManager(mgr ctrl.Manager) error {
+	// Status updates do not change the generation, so they do not trigger another reconcile
 	return ctrl.NewControllerManagedBy(mgr).
-		For(&ApiTransformation{}).
+		For(&ApiTransformation{}, builder.WithPredicates(predicate.GenerationChangedPredicate{})).
 		Complete(r)
 }
 
@@ -305,43 +294,84 @@ func (r *ApiTransformationReconciler) Reconcile(ctx context.Context, req ctrl.Re
 	serverfulApiBase = transformation.Spec.ServerfulApi
 	serverlessApiBase = transformation.Spec.ServerlessApi
 
-	// Iterate through the sync.Map
-	routingCache.Range(func(key, value interface{}) bool {
-		route := key.(string) // Type assertion for key
+	// One round of scrapes per evaluation, shared by every route, see collector.go
+	evaluationInterval := time.Duration(transformation.Spec.EvaluationInterval) * time.Second
+	snapshot, err := r.Collector.Collect(ctx, evaluationInterval/2)
+	if err != nil {
+		logger.Error(err, "Failed to get metrics")
+	}
+	if snapshot == nil || snapshot.Window == nil || snapshot.Time.Equal(r.evaluated) {
+		// Latency is measured between two rounds of scrapes; keep the current split until then
+		return ctrl.Result{RequeueAfter: evaluationInterval}, nil
+	}
+	r.evaluated = snapshot.Time
 
-		avgLatency, err := getAvgLatency(route)
-		if err != nil {
-			logger.Error(err, "Failed to get metrics")
-		}
+	statistic := transformation.Spec.LatencyStatistic
+	if statistic == "" {
+		statistic = "mean"
+	}
+	policyName, policyParams := transformation.Spec.RoutingPolicy, transformation.Spec.RoutingPolicyParameters
+	if policyName == "" {
+		policyName = defaultRoutingPolicy
+	}
+	if _, err := newRoutingPolicy(policyName, policyParams); err != nil {
+		logger.Error(err, "Invalid routing policy, using the threshold policy")
+		policyName, policyParams = defaultRoutingPolicy, nil
+	}
+	var routeStatus []ApiTransformationRouteStatus
 
-		// useServerless := r.shouldUseServerless(metrics, &transformation.Spec)
-		_, ok := route_averages.Load(route)
-		if !ok {
-			avgObj := latencyAverages{}
-			avgObj.initAverages(10, 3)
-			route_averages.Store(route, avgObj)
-		}
+	// Decisions, request counts and policy state are all kept per spec route,
+	// the same requests the app's endpoint label counts
+	for _, spec := range transformation.Spec.Routes {
+		route := spec.Route
 
-		val, _ := route_averages.Load(route)
-		avgObj := val.(latencyAverages)
-		avgObj.updateAverages(avgLatency)
-		route_averages.Store(route, avgObj)
+		// Latency of the last interval, by spec.latencyStatistic; a route the
+		// serverful pods did not serve counts as idle (0), which lets traffic
+		// drift back to them
+		window := snapshot.windowRoute(route)
+		avgLatency, _ := window.statistic(statistic)
+		var requests int64
+		if window != nil {
+			requests = int64(window.Count)
+		}
 
-		ratio := RatioCalculator(avgObj.getAverage(), transformation.Spec.LatencyThreshold)
-		fmt.Println("UPDATED RATIO: ", ratio)
+		// The spec's routing policy turns the interval into a serverful share, see policy.go
+		state, _ := policyFor(routePolicies, route, policyName, policyParams)
+		proxied, cold := requestCount(route), coldStartCount(route)
+		coldStarts := cold - state.coldStarts
+		ratio := state.policy.Decide(policySample{
+			Latency:           avgLatency,
+			Threshold:         transformation.Spec.LatencyThreshold,
+			Requests:          proxied - state.requests,
+			ServerfulRequests: requests,
+			ColdStarts:        coldStarts,
+			Interval:          snapshot.Time.Sub(snapshot.WindowStart),
+		})
+		state.requests, state.coldStarts = proxied, cold
 
 		routingCache.Store(route, &RoutingDecision{
 			ServerfulPercentage: ratio,
 			LastUpdated:         time.Now(),
-			RequestCount:        int64(0),
+			RequestCount:        requests,
 			LatencyAvg:          avgLatency,
 		})
+		routeStatus = append(routeStatus, ApiTransformationRouteStatus{
+			Route: route, Latency: avgLatency, Requests: requests, ColdStarts: coldStarts, ServerfulPercentage: ratio,
+		})
+	}
 
-		return true // Returning true to continue iteration
-	})
+	// Show which policy and statistic drove the split, e.g. kubectl get apitransformation -o yaml
+	sort.Slice(routeStatus, func(i, j int) bool { return routeStatus[i].Route < routeStatus[j].Route })
+	transformation.Status.RoutingPolicy = policyName
+	transformation.Status.LatencyStatistic = statistic
+	transformation.Status.Routes = routeStatus
+	transformation.Status.LastUpdateTime = metav1.Now()
+	if err := r.Status().Update(ctx, &transformation); err != nil {
+		logger.Error(err, "Failed to update status")
+	}
 
 	return ctrl.Result{
-		RequeueAfter: time.Duration(transformation.Spec.EvaluationInterval) * time.Second,
+		RequeueAfter: evaluationInterval,
 	}, nil
 }
 
@@ -364,60 +394,40 @@ func RatioCalculator(max_latency float64, latency_threshold float64) float64 {
 }
 
 func ProxyHandler(w http.ResponseWriter, r *http.Request) {
+	start := time.Now()
 	sourceApi := r.URL.Path
 
-	// Get routing decision from cache
-	decision, ok := routingCache.Load(sourceApi)
-	if !ok {
-		var newRouteDecision = &RoutingDecision{
-			ServerfulPercentage: 1,
-			LastUpdated:         time.Now(),
-			RequestCount:        1,
-			LatencyAvg:          0,
+	// Decisions and counts are kept per spec route, so arbitrary client paths add no entries
+	routingDecision := &RoutingDecision{ServerfulPercentage: 1}
+	route, function, known := lookupRoute(sourceApi)
+	if known {
+		if decision, ok := routingCache.Load(route); ok {
+			routingDecision = decision.(*RoutingDecision)
 		}
-
-		routingCache.Store(sourceApi, newRouteDecision)
-		decision = newRouteDecision
+		recordRequest(route)
+	} else {
+		route = unmatchedRoute
 	}
-
-	routingDecision := decision.(*RoutingDecision)
 	var targetUrl string
+	var targetType string
 
-	// Determine target URL based on routing decision
-	if !ChooseServerful(routingDecision.ServerfulPercentage) {
-		_, ok := routingMap.Load(sourceApi)
-		if !ok {
-			http.Error(w, "Invalid target URL", http.StatusInternalServerError)
-			return
-		}
-		targetUrl = serverlessApiBase
-		countServerless += 1
-		fmt.Printf("*** Serverless Count: %d", countServerless)
+	// Determine target URL based on routing decision; paths without a function stay serverful
+	if known && !ChooseServerful(routingDecision.ServerfulPercentage) {
+		// Each route goes to the function split out for it, e.g. /function/compute
+		targetUrl = functionURL(serverlessApiBase, function)
+		targetType = "serverless"
 	} else {
 		targetUrl = serverfulApiBase
-		countServerful += 1
-		fmt.Printf("*** Serverful Count: %d", countServerful)
+		targetType = "serverful"
 	}
 
-	// Create target URL
-	target, err := url.Parse(targetUrl)
+	// Reuse the backend's proxy and its warm connections, see proxy.go
+	proxy, target, err := proxies.get(targetUrl)
 	if err != nil {
 		http.Error(w, "Invalid target URL", http.StatusInternalServerError)
 		return
 	}
 
-	// Create reverse proxy
-	proxy := httputil.NewSingleHostReverseProxy(target)
-
-	proxy.ModifyResponse = func(resp *http.Response) error {
-		fmt.Println(resp)
-		return nil
-	}
-	proxy.ErrorHandler = func(w http.ResponseWriter, r *http.Request, err error) {
-		http.Error(w, "Proxy error "+err.Error(), http.StatusBadGateway)
-	}
-	proxy.Transport = nil
-
 	// Update request headers
 	r.URL.Host = target.Host
 	r.URL.Scheme = target.Scheme
@@ -425,107 +435,100 @@ func ProxyHandler(w http.ResponseWriter, r *http.Request) {
 	r.Header.Set("X-Routing-Type", fmt.Sprintf("serverless=%v", routingDecision.ServerfulPercentage))
 	r.Host = target.Host
 
-	// Forward the request
-	proxy.ServeHTTP(w, r)
+	// Propagate the trace upstream and time the proxy hop, see tracing.go
+	r = traces.startProxySpans(withRoute(r, route, targetType), sourceApi, targetType, start)
+	defer traces.finishProxySpans(r)
+
+	// Forward the request, then count it and maybe log it, see accesslog.go
+	recorder := &statusRecorder{ResponseWriter: w}
+	proxy.ServeHTTP(recorder, r)
+	recordProxied(r, route, targetType, recorder.status, start)
 }
 
-func getAvgLatency(route string) (float64, error) {
-	// Step 1: Scrape metrics from the /metrics endpoint
-	resp, err := http.Get("http://benchmark-app-service.default.svc.cluster.local:8080/metrics")
-	if err != nil {
-		fmt.Println("Error fetching metrics:", err)
-		return 0, err
+// recordColdStart counts the responses of a spec route that came from a freshly started replica
+func recordColdStart(route string) {
+	count, _ := coldStarts.LoadOrStore(route, new(int64))
+	atomic.AddInt64(count.(*int64), 1)
+	proxyColdStarts.WithLabelValues(route).Inc()
+}
+
+// recordRequest counts the requests the proxy received for a spec route, whichever way they went
+func recordRequest(route string) {
+	count, _ := routeRequests.LoadOrStore(route, new(int64))
+	atomic.AddInt64(count.(*int64), 1)
+}
+
+func requestCount(route string) int64 {
+	count, ok := routeRequests.Load(route)
+	if !ok {
+		return 0
 	}
-	defer resp.Body.Close()
+	return atomic.LoadInt64(count.(*int64))
+}
 
-	body, err := ioutil.ReadAll(resp.Body)
-	if err != nil {
-		fmt.Println("Error reading response body:", err)
-		return 0, err
+func coldStartCount(route string) int64 {
+	count, ok := coldStarts.Load(route)
+	if !ok {
+		return 0
 	}
+	return atomic.LoadInt64(count.(*int64))
+}
 
-	// Step 2: Parse metrics
-	var parser expfmt.TextParser
-	metrics, err := parser.TextToMetricFamilies(bytes.NewReader(body))
-	if err != nil {
-		fmt.Println("Error parsing metrics:", err)
-		return 0, err
-	}
-
-	// Step 3: Extract latency metric
-	metricName := "http_request_latency_seconds" // Adjust to your metric name
-	if family, found := metrics[metricName]; found {
-		for _, m := range family.GetMetric() {
-			for _, label := range m.GetLabel() {
-				if *label.Name == "endpoint" && *label.Value == route {
-					if m.GetHistogram() != nil {
-						hist := m.GetHistogram()
-						count := float64(hist.GetSampleCount())
-						sum := hist.GetSampleSum()
-						// Calculate average latency
-						if count > 0 {
-							averageLatency := sum / count
-							fmt.Printf("Average latency for endpoint %s: %.4f seconds\n", route, averageLatency)
-							return averageLatency, nil
-						} else {
-							fmt.Println("No samples recorded for latency")
-						}
-					}
-				}
-			}
+// lookupRoute finds the spec route matching path and the function serving it.
+// Routes in the spec are either concrete paths or Flask rules, as written by
+// demonfaas/route_classifier.py.
+func lookupRoute(path string) (string, string, bool) {
+	if function, ok := routingMap.Load(path); ok {
+		return path, function.(string), true
+	}
+	var route, match string
+	routingMap.Range(func(key, value interface{}) bool {
+		if routeMatches(key.(string), path) {
+			route, match = key.(string), value.(string)
+			return false
 		}
-	} else {
-		fmt.Println("Latency metric not found")
-	}
-	return 0, nil
+		return true
+	})
+	return route, match, match != ""
 }
 
-func queryPrometheusMetric(query string) (float64, error) {
-	// Step 1: Scrape metrics from the /metrics endpoint
-	resp, err := http.Get("http://benchmark-app-service.default.svc.cluster.local:8080/metrics")
-	if err != nil {
-		fmt.Println("Error fetching metrics:", err)
-		return 0, err
+// functionURL is the gateway URL of function. serverlessApi may be the gateway
+// itself or, as before per-route dispatch, the URL of one of its functions.
+func functionURL(serverlessApi string, function string) string {
+	gateway := strings.TrimRight(serverlessApi, "/")
+	if i := strings.Index(gateway, "/function/"); i >= 0 {
+		gateway = gateway[:i]
 	}
-	defer resp.Body.Close()
+	return gateway + "/function/" + function
+}
 
-	body, err := ioutil.ReadAll(resp.Body)
-	if err != nil {
-		fmt.Println("Error reading response body:", err)
-		return 0, err
+// routeMatches reports whether a request path matches an endpoint label. The
+// apps label latency by their Flask rule (e.g. /computeapi/sieve/<limit>), so
+// each <converter:name> segment matches any single path segment, or the rest
+// of the path for the path converter.
+func routeMatches(template string, path string) bool {
+	if template == path {
+		return true
 	}
-
-	// Step 2: Parse metrics
-	var parser expfmt.TextParser
-	metrics, err := parser.TextToMetricFamilies(bytes.NewReader(body))
-	if err != nil {
-		fmt.Println("Error parsing metrics:", err)
-		return 0, err
-	}
-
-	// Step 3: Extract latency metric
-	metricName := "http_request_latency_seconds" // Adjust to your metric name
-	if family, found := metrics[metricName]; found {
-		for _, m := range family.GetMetric() {
-			if m.GetHistogram() != nil {
-				hist := m.GetHistogram()
-				count := float64(hist.GetSampleCount())
-				sum := hist.GetSampleSum()
-
-				// Calculate average latency
-				if count > 0 {
-					averageLatency := sum / count
-					fmt.Printf("Average latency: %.4f seconds\n", averageLatency)
-					return averageLatency, nil
-				} else {
-					fmt.Println("No samples recorded for latency")
-				}
+	templateParts := strings.Split(template, "/")
+	pathParts := strings.Split(path, "/")
+	for i, part := range templateParts {
+		isVariable := strings.HasPrefix(part, "<") && strings.HasSuffix(part, ">")
+		if isVariable && strings.HasPrefix(part, "<path:") {
+			return i < len(pathParts) && pathParts[i] != ""
+		}
+		if i >= len(pathParts) {
+			return false
+		}
+		if isVariable {
+			if pathParts[i] == "" {
+				return false
 			}
+		} else if part != pathParts[i] {
+			return false
 		}
-	} else {
-		fmt.Println("Latency metric not found")
 	}
-	return 0, nil
+	return len(templateParts) == len(pathParts)
 }
 
 func main() {
@@ -536,6 +539,8 @@ func main() {
 
 	scheme := runtime.NewScheme()
 	_ = AddToScheme(scheme)
+	// EndpointSlices of the serverful Service, for scraping every pod
+	_ = discoveryv1.AddToScheme(scheme)
 	// metav1.AddMetaToScheme(scheme)
 	scheme.AddKnownTypes(GroupVersion,
 		&ApiTransformation{}, // Add your custom ApiTransformation type here
@@ -559,8 +564,9 @@ func main() {
 	}()
 
 	if err := (&ApiTransformationReconciler{
-		Client: mgr.GetClient(),
-		Scheme: mgr.GetScheme(),
+		Client:    mgr.GetClient(),
+		Scheme:    mgr.GetScheme(),
+		Collector: newMetricsCollectorFromEnv(mgr.GetClient()),
 	}).SetupWithManager(mgr); err != nil {
 		panic(fmt.Sprintf("unable to create controller: %v", err))
 	}
@@ -0,0 +1,73 @@
+package main
+
+import (
+	"context"
+	"fmt"
+	"net"
+	"os"
+	"strconv"
+
+	discoveryv1 "k8s.io/api/discovery/v1"
+	"sigs.k8s.io/controller-runtime/pkg/client"
+)
+
+// Scrape targets come from the EndpointSlices of the serverful Service, one per
+// ready pod, so the collector sees every replica instead of whichever pod the
+// ClusterIP picks.
+
+// staticTargets always scrapes url, e.g. METRICS_URL for a single local app
+func staticTargets(url string) scrapeTargets {
+	return func(ctx context.Context) ([]string, error) {
+		return []string{url}, nil
+	}
+}
+
+// endpointTargets lists the ready pod addresses of service in namespace and
+// scrapes each of them on port. While the Service has no ready endpoints, or
+// its EndpointSlices cannot be read, it falls back to the Service itself.
+func endpointTargets(c client.Reader, namespace string, service string, port int) scrapeTargets {
+	fallback := fmt.Sprintf("http://%s.%s.svc.cluster.local:%d/metrics", service, namespace, port)
+	return func(ctx context.Context) ([]string, error) {
+		var slices discoveryv1.EndpointSliceList
+		if err := c.List(ctx, &slices, client.InNamespace(namespace), client.MatchingLabels{discoveryv1.LabelServiceName: service}); err != nil {
+			logger.Error(err, "Failed to list endpoints, scraping through the service", "service", service)
+			return []string{fallback}, nil
+		}
+		seen := map[string]bool{}
+		var urls []string
+		for _, slice := range slices.Items {
+			for _, endpoint := range slice.Endpoints {
+				if endpoint.Conditions.Ready != nil && !*endpoint.Conditions.Ready {
+					continue
+				}
+				for _, address := range endpoint.Addresses {
+					url := "http://" + net.JoinHostPort(address, strconv.Itoa(port)) + "/metrics"
+					if !seen[url] {
+						seen[url] = true
+						urls = append(urls, url)
+					}
+				}
+			}
+		}
+		if len(urls) == 0 {
+			return []string{fallback}, nil
+		}
+		return urls, nil
+	}
+}
+
+// newMetricsCollectorFromEnv scrapes METRICS_URL when it is set, and otherwise
+// every pod of METRICS_SERVICE (default benchmark-app-service) in
+// METRICS_NAMESPACE (default default) on METRICS_PORT (default 8080), with at
+// most METRICS_SCRAPE_WORKERS (default 8) scrapes at a time
+func newMetricsCollectorFromEnv(c client.Reader) *metricsCollector {
+	workers := envInt("METRICS_SCRAPE_WORKERS", defaultScrapeWorkers)
+	if url := os.Getenv("METRICS_URL"); url != "" {
+		return newMetricsCollector(staticTargets(url), workers)
+	}
+	return newMetricsCollector(endpointTargets(c,
+		envOrDefault("METRICS_NAMESPACE", "default"),
+		envOrDefault("METRICS_SERVICE", defaultMetricsService),
+		envInt("METRICS_PORT", defaultMetricsPort),
+	), workers)
+}
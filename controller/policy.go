@@ -0,0 +1,240 @@
+package main
+
+import (
+	"fmt"
+	"math"
+	"sync"
+	"time"
+)
+
+// Routing policies turn what one evaluation interval measured for a route into
+// the share of its requests kept on the serverful service. The policy of an
+// ApiTransformation is chosen by spec.routingPolicy and tuned through
+// spec.routingPolicyParameters; policies keep their own per-route state, and
+// only use the standard library so they can be driven by synthetic streams.
+
+// policySample is what Reconcile measured for a route over one interval
+type policySample struct {
+	// Latency of the serverful pods by spec.latencyStatistic, in seconds; 0 when they served nothing
+	Latency float64
+	// Threshold is spec.latencyThreshold
+	Threshold float64
+	// Requests the proxy received for the route, and how many the serverful pods served
+	Requests          int64
+	ServerfulRequests int64
+	// Serverless responses that came from a freshly started function replica
+	ColdStarts int64
+	Interval   time.Duration
+}
+
+// RoutingPolicy decides the serverful share (0 to 1) of a route from one
+// sample per evaluation interval
+type RoutingPolicy interface {
+	Decide(sample policySample) float64
+}
+
+const defaultRoutingPolicy = "threshold"
+
+// newRoutingPolicy builds the policy called name. Parameters missing from
+// params keep their defaults; unknown names are an error.
+func newRoutingPolicy(name string, params map[string]float64) (RoutingPolicy, error) {
+	param := func(key string, fallback float64) float64 {
+		if value, ok := params[key]; ok {
+			return value
+		}
+		return fallback
+	}
+	switch name {
+	case "", "threshold":
+		return newThresholdPolicy(
+			int(param("slowWindow", 10)), int(param("fastWindow", 3)),
+			param("increase", 0.1), param("decrease", 0.2), param("minShare", 0.05),
+		), nil
+	case "ewma":
+		return &ewmaPolicy{
+			Alpha: param("alpha", 0.3), High: param("high", 0.9), Low: param("low", 0.6),
+			Step: param("step", 0.2), share: 1,
+		}, nil
+	case "pid":
+		return &pidPolicy{
+			Setpoint: param("setpoint", 0.8), Kp: param("kp", 0.1), Ki: param("ki", 0.005), Kd: param("kd", 0),
+		}, nil
+	case "cost":
+		return &costPolicy{
+			Headroom: param("headroom", 0.8), Alpha: param("alpha", 0.5), Low: param("low", 0.6), Probe: param("probe", 0.1),
+		}, nil
+	default:
+		return nil, fmt.Errorf("unknown routing policy %q", name)
+	}
+}
+
+func clampShare(share float64) float64 {
+	return math.Max(0, math.Min(1, share))
+}
+
+// thresholdPolicy keeps the original rule's latency signal, the larger of a
+// slow and a fast moving average, and places it on RatioCalculator's ramp (all
+// serverful below 60% of the threshold, none at it). Mapping the average to the
+// share directly swings between all and no traffic under overload, so instead
+// the share grows by up to Increase per interval in the lower half of the ramp
+// and below it, and shrinks by up to Decrease in the upper half and above. It
+// settles where the average is 85% of the threshold. Intervals in which the
+// pods served nothing are left out of the averages rather than read as fast,
+// and the share stays at MinShare or above so the pods keep being measured.
+type thresholdPolicy struct {
+	Increase, Decrease, MinShare float64
+
+	averages latencyAverages
+	share    float64
+}
+
+func newThresholdPolicy(slowWindow int, fastWindow int, increase float64, decrease float64, minShare float64) *thresholdPolicy {
+	p := &thresholdPolicy{Increase: increase, Decrease: decrease, MinShare: minShare, share: 1}
+	p.averages.initAverages(slowWindow, fastWindow)
+	return p
+}
+
+func (p *thresholdPolicy) Decide(s policySample) float64 {
+	if s.ServerfulRequests > 0 {
+		p.averages.updateAverages(s.Latency)
+	}
+	// -1 at or above the threshold, 1 below 60% of it
+	pressure := 2*RatioCalculator(p.averages.getAverage(), s.Threshold) - 1
+	if pressure >= 0 {
+		p.share *= 1 + p.Increase*pressure
+	} else {
+		p.share *= 1 + p.Decrease*pressure
+	}
+	p.share = math.Max(p.MinShare, clampShare(p.share))
+	return p.share
+}
+
+// ewmaPolicy smooths latency with an exponentially weighted moving average and
+// moves the share by Step per interval: towards serverless while the average is
+// above High times the threshold, back while it is below Low times the
+// threshold, and not at all in between, so the split does not flap around the
+// threshold
+type ewmaPolicy struct {
+	Alpha, High, Low, Step float64
+
+	average float64
+	started bool
+	share   float64
+}
+
+func (p *ewmaPolicy) Decide(s policySample) float64 {
+	if !p.started {
+		p.average, p.started = s.Latency, true
+	} else {
+		p.average = p.Alpha*s.Latency + (1-p.Alpha)*p.average
+	}
+	switch {
+	case p.average > p.High*s.Threshold:
+		p.share = clampShare(p.share - p.Step)
+	case p.average < p.Low*s.Threshold:
+		p.share = clampShare(p.share + p.Step)
+	}
+	return p.share
+}
+
+// pidPolicy steers serverful latency to Setpoint times the threshold. It is in
+// incremental (velocity) form: each interval moves the share by the change of
+// the PID output, so the share itself holds the integral and cannot wind up
+// while pinned at 0 or 1. The error is normalised by the threshold and clamped
+// to [-1, 1], as latency grows without bound once the pods saturate.
+type pidPolicy struct {
+	Setpoint, Kp, Ki, Kd float64
+
+	share      float64
+	lastError  float64
+	lastChange float64
+	started    bool
+}
+
+func (p *pidPolicy) Decide(s policySample) float64 {
+	if s.Threshold <= 0 {
+		return 1
+	}
+	dt := s.Interval.Seconds()
+	if dt <= 0 {
+		dt = 1
+	}
+	err := math.Max(-1, math.Min(1, (s.Latency-p.Setpoint*s.Threshold)/s.Threshold))
+	if !p.started {
+		p.share, p.lastError, p.started = 1, err, true
+	}
+	change := err - p.lastError
+	p.share = clampShare(p.share - (p.Kp*change + p.Ki*err*dt + p.Kd*(change-p.lastChange)/dt))
+	p.lastError, p.lastChange = err, change
+	return p.share
+}
+
+// costPolicy keeps as much traffic on the serverful pods as they can serve
+// within the threshold, since they are paid for whether busy or not, and sends
+// only the overflow to functions billed per invocation. It learns the request
+// rate the pods sustain from the rate at which latency reached the threshold,
+// offers them Headroom times that, and raises the estimate by Probe while they
+// serve their full allotment well below the threshold (under Low times it).
+// Offloaded requests that hit a cold start pay the function's startup on top,
+// so the headroom shrinks towards the full estimate with the share of them
+// that did.
+type costPolicy struct {
+	Headroom, Alpha, Low, Probe float64
+
+	capacity float64
+}
+
+func (p *costPolicy) Decide(s policySample) float64 {
+	seconds := s.Interval.Seconds()
+	if seconds <= 0 || s.Requests == 0 {
+		// Nothing to route; keep the pods warm for the next burst
+		return 1
+	}
+	total := float64(s.Requests) / seconds
+	served := float64(s.ServerfulRequests) / seconds
+	switch {
+	case s.Latency >= s.Threshold && served > 0:
+		// Saturated: the pods cannot take more than they just served
+		if p.capacity == 0 {
+			p.capacity = served
+		} else {
+			p.capacity = p.Alpha*served + (1-p.Alpha)*p.capacity
+		}
+	case p.capacity > 0 && s.Latency < p.Low*s.Threshold && served >= 0.9*p.Headroom*p.capacity:
+		p.capacity *= 1 + p.Probe
+	}
+	if p.capacity == 0 {
+		// No saturation seen yet, everything stays serverful
+		return 1
+	}
+	headroom := p.Headroom
+	if offloaded := s.Requests - s.ServerfulRequests; s.ColdStarts > 0 && offloaded > 0 {
+		headroom += (1 - headroom) * math.Min(1, float64(s.ColdStarts)/float64(offloaded))
+	}
+	return clampShare(headroom * p.capacity / total)
+}
+
+// routePolicy is the policy deciding one route, with the proxy's request and
+// cold start counts at the last decision
+type routePolicy struct {
+	key        string
+	policy     RoutingPolicy
+	requests   int64
+	coldStarts int64
+}
+
+// policyFor returns the policy state of route, starting over when the spec's
+// policy or its parameters changed
+func policyFor(policies *sync.Map, route string, name string, params map[string]float64) (*routePolicy, error) {
+	key := name + fmt.Sprint(params)
+	if state, ok := policies.Load(route); ok && state.(*routePolicy).key == key {
+		return state.(*routePolicy), nil
+	}
+	policy, err := newRoutingPolicy(name, params)
+	if err != nil {
+		return nil, err
+	}
+	state := &routePolicy{key: key, policy: policy, requests: requestCount(route), coldStarts: coldStartCount(route)}
+	policies.Store(route, state)
+	return state, nil
+}
@@ -0,0 +1,163 @@
+package main
+
+import (
+	"math"
+	"testing"
+	"time"
+)
+
+// fleet is a synthetic serverful deployment: latency grows as its load nears
+// capacity, like a queue (base / (1 - utilisation)), and is capped at 10x base
+type fleet struct {
+	capacity float64 // requests per second
+	base     float64 // seconds
+}
+
+func (f fleet) latency(rate float64) float64 {
+	utilisation := rate / f.capacity
+	if utilisation >= 0.9 {
+		return 10 * f.base
+	}
+	return f.base / (1 - utilisation)
+}
+
+// run drives policy through a stream of offered request rates, one per
+// interval, and returns the serverful share and latency after each interval
+func run(t *testing.T, policy RoutingPolicy, f fleet, threshold float64, rates []float64) ([]float64, []float64) {
+	t.Helper()
+	interval := 30 * time.Second
+	share := 1.0
+	var shares, latencies []float64
+	for _, rate := range rates {
+		served := share * rate
+		latency := 0.0
+		if served > 0 {
+			latency = f.latency(served)
+		}
+		share = policy.Decide(policySample{
+			Latency:           latency,
+			Threshold:         threshold,
+			Requests:          int64(rate * interval.Seconds()),
+			ServerfulRequests: int64(served * interval.Seconds()),
+			Interval:          interval,
+		})
+		if share < 0 || share > 1 || math.IsNaN(share) {
+			t.Fatalf("share %v out of range", share)
+		}
+		shares = append(shares, share)
+		latencies = append(latencies, latency)
+	}
+	return shares, latencies
+}
+
+// stream is a quiet period, a load step to twice the fleet's capacity and a
+// return to quiet
+func stream() []float64 {
+	var rates []float64
+	for i := 0; i < 10; i++ {
+		rates = append(rates, 20)
+	}
+	for i := 0; i < 40; i++ {
+		rates = append(rates, 200)
+	}
+	for i := 0; i < 30; i++ {
+		rates = append(rates, 20)
+	}
+	return rates
+}
+
+func TestPoliciesFollowLoad(t *testing.T) {
+	f := fleet{capacity: 100, base: 0.05}
+	threshold := 0.2
+	for _, name := range []string{"threshold", "ewma", "pid", "cost"} {
+		policy, err := newRoutingPolicy(name, nil)
+		if err != nil {
+			t.Fatal(err)
+		}
+		shares, latencies := run(t, policy, f, threshold, stream())
+		var overload float64
+		for _, share := range shares[20:50] {
+			overload += share / 30
+		}
+		t.Logf("%s: quiet %.2f, overload %.2f (mean %.2f, latency %.3fs), recovered %.2f",
+			name, shares[9], shares[49], overload, latencies[49], shares[79])
+		if shares[9] != 1 {
+			t.Errorf("%s: moved traffic off an idle fleet: %.2f", name, shares[9])
+		}
+		if overload >= 0.5 {
+			t.Errorf("%s: did not offload the overload: mean share %.2f", name, overload)
+		}
+		if latencies[49] > threshold {
+			t.Errorf("%s: latency %.3fs above the threshold after 40 intervals", name, latencies[49])
+		}
+		if shares[79] != 1 {
+			t.Errorf("%s: did not return to serverful: %.2f", name, shares[79])
+		}
+	}
+}
+
+func TestEwmaHysteresisHolds(t *testing.T) {
+	policy, _ := newRoutingPolicy("ewma", nil)
+	// Between the low and high bands the share must not move
+	for i := 0; i < 20; i++ {
+		if share := policy.Decide(policySample{Latency: 0.15, Threshold: 0.2, Interval: 30 * time.Second}); share != 1 {
+			t.Fatalf("share moved to %.2f inside the band", share)
+		}
+	}
+}
+
+func TestThresholdSettles(t *testing.T) {
+	policy, _ := newRoutingPolicy("threshold", nil)
+	shares, latencies := run(t, policy, fleet{capacity: 100, base: 0.05}, 0.2, stream())
+	// No swings once the overload has lasted 30 intervals
+	for i := 40; i < 50; i++ {
+		if latencies[i] > 0.2 || math.Abs(shares[i]-shares[39]) > 0.05 {
+			t.Errorf("interval %d: share %.2f (from %.2f), latency %.3fs", i, shares[i], shares[39], latencies[i])
+		}
+	}
+}
+
+func TestThresholdIgnoresIdleIntervals(t *testing.T) {
+	policy, _ := newRoutingPolicy("threshold", nil)
+	saturated := policySample{Latency: 0.3, Threshold: 0.2, Requests: 6000, ServerfulRequests: 3000, Interval: 30 * time.Second}
+	var share float64
+	for i := 0; i < 3; i++ {
+		share = policy.Decide(saturated)
+	}
+	// The pods served nothing, which must not read as 0s of latency
+	idle := policySample{Threshold: 0.2, Requests: 6000, Interval: 30 * time.Second}
+	for i := 0; i < 5; i++ {
+		if next := policy.Decide(idle); next > share {
+			t.Fatalf("share rose from %.2f to %.2f without serverful requests", share, next)
+		} else {
+			share = next
+		}
+	}
+	if share < 0.05 {
+		t.Errorf("share %.3f below minShare", share)
+	}
+}
+
+func TestCostPolicyColdStarts(t *testing.T) {
+	saturated := policySample{Latency: 0.3, Threshold: 0.2, Requests: 6000, ServerfulRequests: 3000, Interval: 30 * time.Second}
+	decide := func(coldStarts int64) float64 {
+		policy, _ := newRoutingPolicy("cost", nil)
+		policy.Decide(saturated)
+		sample := saturated
+		sample.Latency, sample.ColdStarts = 0.15, coldStarts
+		return policy.Decide(sample)
+	}
+	warm, cold, allCold := decide(0), decide(1500), decide(3000)
+	// 100 req/s capacity, 200 req/s offered: headroom 0.8 of it, then 0.9 and 1 with half and all offloads cold
+	for _, c := range []struct{ got, want float64 }{{warm, 0.4}, {cold, 0.45}, {allCold, 0.5}} {
+		if math.Abs(c.got-c.want) > 1e-9 {
+			t.Errorf("share %.3f, want %.3f", c.got, c.want)
+		}
+	}
+}
+
+func TestUnknownPolicy(t *testing.T) {
+	if _, err := newRoutingPolicy("random", nil); err == nil {
+		t.Fatal("expected an error")
+	}
+}
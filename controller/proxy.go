@@ -0,0 +1,117 @@
+package main
+
+import (
+	"context"
+	"net"
+	"net/http"
+	"net/http/httputil"
+	"net/url"
+	"os"
+	"strconv"
+	"sync"
+	"time"
+)
+
+// Reverse proxies are kept per backend, so every request to the gateway or the
+// serverful service reuses the same transport and its pool of warm keep-alive
+// connections instead of dialing (and leaking) a fresh one.
+
+const (
+	defaultMaxIdleConnsPerHost = 256
+	defaultMaxConnsPerHost     = 1024
+	proxyIdleConnTimeout       = 90 * time.Second
+	proxyDialTimeout           = 5 * time.Second
+	proxyKeepAlive             = 30 * time.Second
+)
+
+type proxyRouteKey struct{}
+
+// proxyRoute is the spec route of a request and the kind of backend it was sent to
+type proxyRoute struct {
+	route  string
+	target string
+}
+
+// backendProxies maps a backend base URL to its *httputil.ReverseProxy
+type backendProxies struct {
+	proxies   sync.Map
+	mu        sync.Mutex
+	transport http.RoundTripper
+}
+
+func newBackendProxies(transport http.RoundTripper) *backendProxies {
+	return &backendProxies{transport: transport}
+}
+
+// newBackendTransport tunes the connection pool for many small requests to few
+// hosts. PROXY_MAX_IDLE_CONNS_PER_HOST and PROXY_MAX_CONNS_PER_HOST override
+// the pool sizes; Go's default of 2 idle connections per host would close and
+// redial almost every connection under load.
+func newBackendTransport() *http.Transport {
+	maxIdle := envInt("PROXY_MAX_IDLE_CONNS_PER_HOST", defaultMaxIdleConnsPerHost)
+	dialer := &net.Dialer{Timeout: proxyDialTimeout, KeepAlive: proxyKeepAlive}
+	return &http.Transport{
+		Proxy:                 http.ProxyFromEnvironment,
+		DialContext:           dialer.DialContext,
+		MaxIdleConns:          maxIdle * 4,
+		MaxIdleConnsPerHost:   maxIdle,
+		MaxConnsPerHost:       envInt("PROXY_MAX_CONNS_PER_HOST", defaultMaxConnsPerHost),
+		IdleConnTimeout:       proxyIdleConnTimeout,
+		TLSHandshakeTimeout:   proxyDialTimeout,
+		ExpectContinueTimeout: time.Second,
+	}
+}
+
+func envInt(name string, fallback int) int {
+	if value, err := strconv.Atoi(os.Getenv(name)); err == nil && value >= 0 {
+		return value
+	}
+	return fallback
+}
+
+// get returns the proxy for base, creating it on first use
+func (b *backendProxies) get(base string) (*httputil.ReverseProxy, *url.URL, error) {
+	if entry, ok := b.proxies.Load(base); ok {
+		p := entry.(*backendProxy)
+		return p.proxy, p.target, nil
+	}
+	b.mu.Lock()
+	defer b.mu.Unlock()
+	if entry, ok := b.proxies.Load(base); ok {
+		p := entry.(*backendProxy)
+		return p.proxy, p.target, nil
+	}
+	target, err := url.Parse(base)
+	if err != nil {
+		return nil, nil, err
+	}
+	proxy := httputil.NewSingleHostReverseProxy(target)
+	proxy.Transport = b.transport
+	proxy.ModifyResponse = func(resp *http.Response) error {
+		// Functions flag the first response of a fresh replica, see app/startup.py.
+		// The serverful pods run the same apps and flag every new worker, which is
+		// not a cold start of the serverless path.
+		if resp.Header.Get("X-Cold-Start") != "" {
+			if source, ok := resp.Request.Context().Value(proxyRouteKey{}).(proxyRoute); ok && source.target == "serverless" {
+				recordColdStart(source.route)
+			}
+		}
+		traces.upstreamResponded(resp)
+		return nil
+	}
+	proxy.ErrorHandler = func(w http.ResponseWriter, r *http.Request, err error) {
+		http.Error(w, "Proxy error "+err.Error(), http.StatusBadGateway)
+	}
+	b.proxies.Store(base, &backendProxy{proxy: proxy, target: target})
+	return proxy, target, nil
+}
+
+type backendProxy struct {
+	proxy  *httputil.ReverseProxy
+	target *url.URL
+}
+
+// withRoute remembers the source route and target type for the shared ModifyResponse hook
+func withRoute(r *http.Request, route string, targetType string) *http.Request {
+	return r.WithContext(context.WithValue(r.Context(), proxyRouteKey{}, proxyRoute{route: route, target: targetType}))
+}
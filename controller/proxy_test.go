@@ -0,0 +1,43 @@
+package main
+
+import (
+	"net/http"
+	"net/http/httptest"
+	"testing"
+)
+
+// coldBackend answers every request as a freshly started replica would
+func coldBackend() *httptest.Server {
+	return httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		w.Header().Set("X-Cold-Start", "1")
+		w.WriteHeader(http.StatusOK)
+	}))
+}
+
+func TestColdStartsCountOnlyServerless(t *testing.T) {
+	serverful, serverless := coldBackend(), coldBackend()
+	defer serverful.Close()
+	defer serverless.Close()
+	serverfulApiBase, serverlessApiBase = serverful.URL, serverless.URL
+	route := "/quickapi/cold-start-test"
+	routingMap.Store(route, "quick")
+	defer routingMap.Delete(route)
+	defer routingCache.Delete(route)
+
+	for _, tc := range []struct {
+		target string
+		share  float64
+		want   int64
+	}{{"serverful", 1, 0}, {"serverless", 0, 1}} {
+		routingCache.Store(route, &RoutingDecision{ServerfulPercentage: tc.share})
+		before := coldStartCount(route)
+		recorder := httptest.NewRecorder()
+		ProxyHandler(recorder, httptest.NewRequest(http.MethodGet, route, nil))
+		if recorder.Code != http.StatusOK {
+			t.Fatalf("%s: status %d", tc.target, recorder.Code)
+		}
+		if got := coldStartCount(route) - before; got != tc.want {
+			t.Errorf("%s: counted %d cold starts, want %d", tc.target, got, tc.want)
+		}
+	}
+}
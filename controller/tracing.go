@@ -0,0 +1,346 @@
+package main
+
+import (
+	"bytes"
+	"context"
+	"crypto/rand"
+	"encoding/hex"
+	"encoding/json"
+	"fmt"
+	"net/http"
+	"os"
+	"strconv"
+	"strings"
+	"sync"
+	"time"
+)
+
+// W3C trace context (https://www.w3.org/TR/trace-context/) for the proxy. Every
+// proxied request gets a server span for the whole proxy hop and a client span
+// for the upstream call; the client span's id is forwarded as the parent of the
+// function's own span, so proxy overhead, gateway/watchdog time and handler time
+// can be told apart.
+
+const (
+	spanKindServer = 2
+	spanKindClient = 3
+
+	traceBatchSize     = 256
+	traceQueueSize     = 4096
+	traceFlushInterval = 2 * time.Second
+)
+
+type spanContext struct {
+	TraceID string
+	SpanID  string
+	Flags   byte
+}
+
+func (sc spanContext) sampled() bool {
+	return sc.Flags&1 == 1
+}
+
+func (sc spanContext) traceparent() string {
+	return fmt.Sprintf("00-%s-%s-%02x", sc.TraceID, sc.SpanID, sc.Flags)
+}
+
+// parseTraceparent reads a version 00 traceparent header
+func parseTraceparent(header string) (spanContext, bool) {
+	parts := strings.Split(strings.ToLower(strings.TrimSpace(header)), "-")
+	if len(parts) != 4 || parts[0] != "00" || !isHex(parts[1], 32) || !isHex(parts[2], 16) || !isHex(parts[3], 2) {
+		return spanContext{}, false
+	}
+	if parts[1] == strings.Repeat("0", 32) || parts[2] == strings.Repeat("0", 16) {
+		return spanContext{}, false
+	}
+	flags, _ := strconv.ParseUint(parts[3], 16, 8)
+	return spanContext{TraceID: parts[1], SpanID: parts[2], Flags: byte(flags)}, true
+}
+
+func isHex(s string, length int) bool {
+	if len(s) != length {
+		return false
+	}
+	_, err := hex.DecodeString(s)
+	return err == nil
+}
+
+func randomHex(n int) string {
+	b := make([]byte, n)
+	rand.Read(b)
+	return hex.EncodeToString(b)
+}
+
+type span struct {
+	TraceID      string
+	SpanID       string
+	ParentSpanID string
+	Name         string
+	Kind         int
+	Start        time.Time
+	End          time.Time
+	Attributes   map[string]string
+}
+
+// SpanExporter receives finished spans in batches. Swap in a stub to test or to
+// drop tracing entirely.
+type SpanExporter interface {
+	Export(spans []span) error
+}
+
+// fileExporter appends one OTLP/JSON export request per batch to a file
+type fileExporter struct {
+	path        string
+	serviceName string
+	mu          sync.Mutex
+}
+
+func (e *fileExporter) Export(spans []span) error {
+	line, err := json.Marshal(otlpRequest(e.serviceName, spans))
+	if err != nil {
+		return err
+	}
+	e.mu.Lock()
+	defer e.mu.Unlock()
+	f, err := os.OpenFile(e.path, os.O_APPEND|os.O_CREATE|os.O_WRONLY, 0644)
+	if err != nil {
+		return err
+	}
+	defer f.Close()
+	_, err = f.Write(append(line, '\n'))
+	return err
+}
+
+// otlpExporter posts batches to an OTLP/HTTP collector
+type otlpExporter struct {
+	url         string
+	serviceName string
+	client      *http.Client
+}
+
+func (e *otlpExporter) Export(spans []span) error {
+	body, err := json.Marshal(otlpRequest(e.serviceName, spans))
+	if err != nil {
+		return err
+	}
+	resp, err := e.client.Post(e.url, "application/json", bytes.NewReader(body))
+	if err != nil {
+		return err
+	}
+	resp.Body.Close()
+	if resp.StatusCode >= 300 {
+		return fmt.Errorf("otlp collector returned %s", resp.Status)
+	}
+	return nil
+}
+
+// memoryExporter keeps every span, for tests
+type memoryExporter struct {
+	mu    sync.Mutex
+	spans []span
+}
+
+func (e *memoryExporter) Export(spans []span) error {
+	e.mu.Lock()
+	defer e.mu.Unlock()
+	e.spans = append(e.spans, spans...)
+	return nil
+}
+
+func (e *memoryExporter) Spans() []span {
+	e.mu.Lock()
+	defer e.mu.Unlock()
+	return append([]span(nil), e.spans...)
+}
+
+func otlpRequest(serviceName string, spans []span) map[string]interface{} {
+	otlpSpans := make([]map[string]interface{}, 0, len(spans))
+	for _, s := range spans {
+		attributes := make([]map[string]interface{}, 0, len(s.Attributes))
+		for key, value := range s.Attributes {
+			attributes = append(attributes, otlpAttribute(key, value))
+		}
+		otlpSpans = append(otlpSpans, map[string]interface{}{
+			"traceId":           s.TraceID,
+			"spanId":            s.SpanID,
+			"parentSpanId":      s.ParentSpanID,
+			"name":              s.Name,
+			"kind":              s.Kind,
+			"startTimeUnixNano": strconv.FormatInt(s.Start.UnixNano(), 10),
+			"endTimeUnixNano":   strconv.FormatInt(s.End.UnixNano(), 10),
+			"attributes":        attributes,
+		})
+	}
+	return map[string]interface{}{
+		"resourceSpans": []map[string]interface{}{{
+			"resource": map[string]interface{}{
+				"attributes": []map[string]interface{}{otlpAttribute("service.name", serviceName)},
+			},
+			"scopeSpans": []map[string]interface{}{{
+				"scope": map[string]interface{}{"name": "demonfaas"},
+				"spans": otlpSpans,
+			}},
+		}},
+	}
+}
+
+func otlpAttribute(key string, value string) map[string]interface{} {
+	return map[string]interface{}{"key": key, "value": map[string]interface{}{"stringValue": value}}
+}
+
+// tracer batches finished spans and exports them from a background goroutine.
+// A full queue drops spans instead of blocking the proxy.
+type tracer struct {
+	exporter SpanExporter
+	queue    chan span
+	flush    chan chan struct{}
+}
+
+func newTracer(exporter SpanExporter) *tracer {
+	t := &tracer{exporter: exporter}
+	if exporter != nil {
+		t.queue = make(chan span, traceQueueSize)
+		t.flush = make(chan chan struct{})
+		go t.run()
+	}
+	return t
+}
+
+// newTracerFromEnv picks the exporter from TRACE_EXPORTER: none (default), file or otlp
+func newTracerFromEnv() *tracer {
+	serviceName := envOrDefault("TRACE_SERVICE_NAME", "demonfaas-proxy")
+	switch os.Getenv("TRACE_EXPORTER") {
+	case "file":
+		return newTracer(&fileExporter{path: envOrDefault("TRACE_FILE", "/tmp/demonfaas-spans.jsonl"), serviceName: serviceName})
+	case "otlp":
+		endpoint := strings.TrimRight(envOrDefault("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318"), "/")
+		return newTracer(&otlpExporter{url: endpoint + "/v1/traces", serviceName: serviceName, client: &http.Client{Timeout: 5 * time.Second}})
+	default:
+		return newTracer(nil)
+	}
+}
+
+func envOrDefault(name string, fallback string) string {
+	if value := os.Getenv(name); value != "" {
+		return value
+	}
+	return fallback
+}
+
+func (t *tracer) end(s span) {
+	if t.queue == nil {
+		return
+	}
+	s.End = time.Now()
+	select {
+	case t.queue <- s:
+	default:
+	}
+}
+
+// Flush exports every queued span before returning
+func (t *tracer) Flush() {
+	if t.flush == nil {
+		return
+	}
+	done := make(chan struct{})
+	t.flush <- done
+	<-done
+}
+
+func (t *tracer) run() {
+	ticker := time.NewTicker(traceFlushInterval)
+	defer ticker.Stop()
+	batch := make([]span, 0, traceBatchSize)
+	export := func() {
+		if len(batch) == 0 {
+			return
+		}
+		if err := t.exporter.Export(batch); err != nil {
+			logger.Error(err, "Failed to export spans", "spans", len(batch))
+		}
+		batch = make([]span, 0, traceBatchSize)
+	}
+	for {
+		select {
+		case s := <-t.queue:
+			batch = append(batch, s)
+			if len(batch) == traceBatchSize {
+				export()
+			}
+		case <-ticker.C:
+			export()
+		case done := <-t.flush:
+			for len(t.queue) > 0 {
+				batch = append(batch, <-t.queue)
+			}
+			export()
+			close(done)
+		}
+	}
+}
+
+type proxySpansKey struct{}
+
+// proxySpans are the spans of one proxied request
+type proxySpans struct {
+	server      span
+	client      span
+	sampled     bool
+	clientEnded bool
+}
+
+// startProxySpans continues the caller's trace, or starts one, and sets the
+// traceparent forwarded upstream to the client span. The server span starts at
+// start, when the proxy received the request.
+func (t *tracer) startProxySpans(r *http.Request, route string, target string, start time.Time) *http.Request {
+	parent, ok := parseTraceparent(r.Header.Get("traceparent"))
+	if !ok {
+		parent = spanContext{TraceID: randomHex(16), Flags: 1}
+	}
+	now := time.Now()
+	spans := &proxySpans{sampled: parent.sampled()}
+	spans.server = span{
+		TraceID: parent.TraceID, SpanID: randomHex(8), ParentSpanID: parent.SpanID,
+		Name: r.Method + " " + route, Kind: spanKindServer, Start: start,
+		Attributes: map[string]string{"http.request.method": r.Method, "url.path": r.URL.Path, "demonfaas.target": target},
+	}
+	spans.client = span{
+		TraceID: parent.TraceID, SpanID: randomHex(8), ParentSpanID: spans.server.SpanID,
+		Name: r.Method + " " + target, Kind: spanKindClient, Start: now,
+		Attributes: map[string]string{"demonfaas.target": target},
+	}
+
+	r.Header.Set("traceparent", spanContext{TraceID: parent.TraceID, SpanID: spans.client.SpanID, Flags: parent.Flags}.traceparent())
+	// Functions record how long the request waited behind the gateway and watchdog, see app/metrics.py.
+	// A load balancer in front of the proxy may have set it already, covering its own queue too.
+	if r.Header.Get("X-Request-Start") == "" {
+		r.Header.Set("X-Request-Start", fmt.Sprintf("t=%d", now.UnixMicro()))
+	}
+	return r.WithContext(context.WithValue(r.Context(), proxySpansKey{}, spans))
+}
+
+// upstreamResponded ends the client span once the upstream response headers arrive
+func (t *tracer) upstreamResponded(resp *http.Response) {
+	spans, ok := resp.Request.Context().Value(proxySpansKey{}).(*proxySpans)
+	if !ok || !spans.sampled {
+		return
+	}
+	spans.client.Attributes["http.response.status_code"] = strconv.Itoa(resp.StatusCode)
+	t.end(spans.client)
+	spans.clientEnded = true
+}
+
+// finishProxySpans ends the server span, and the client span when the upstream
+// call failed before responding
+func (t *tracer) finishProxySpans(r *http.Request) {
+	spans, ok := r.Context().Value(proxySpansKey{}).(*proxySpans)
+	if !ok || !spans.sampled {
+		return
+	}
+	if !spans.clientEnded {
+		spans.client.Attributes["error.type"] = "upstream"
+		t.end(spans.client)
+	}
+	t.end(spans.server)
+}
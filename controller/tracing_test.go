@@ -0,0 +1,162 @@
+package main
+
+import (
+	"encoding/json"
+	"net/http"
+	"net/http/httptest"
+	"strings"
+	"testing"
+	"time"
+)
+
+func TestParseTraceparent(t *testing.T) {
+	for _, tc := range []struct {
+		header string
+		ok     bool
+		want   spanContext
+	}{
+		{"00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01", true,
+			spanContext{TraceID: "4bf92f3577b34da6a3ce929d0e0e4736", SpanID: "00f067aa0ba902b7", Flags: 1}},
+		{" 00-4BF92F3577B34DA6A3CE929D0E0E4736-00F067AA0BA902B7-00 ", true,
+			spanContext{TraceID: "4bf92f3577b34da6a3ce929d0e0e4736", SpanID: "00f067aa0ba902b7", Flags: 0}},
+		{"", false, spanContext{}},
+		{"01-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01", false, spanContext{}},
+		{"00-4bf92f3577b34da6a3ce929d0e0e473-00f067aa0ba902b7-01", false, spanContext{}},
+		{"00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902bz-01", false, spanContext{}},
+		{"00-00000000000000000000000000000000-00f067aa0ba902b7-01", false, spanContext{}},
+		{"00-4bf92f3577b34da6a3ce929d0e0e4736-0000000000000000-01", false, spanContext{}},
+	} {
+		got, ok := parseTraceparent(tc.header)
+		if ok != tc.ok || got != tc.want {
+			t.Errorf("parseTraceparent(%q) = %+v, %v; want %+v, %v", tc.header, got, ok, tc.want, tc.ok)
+		}
+		if normalized := strings.ToLower(strings.TrimSpace(tc.header)); ok && got.traceparent() != normalized {
+			t.Errorf("traceparent() = %q, want %q", got.traceparent(), normalized)
+		}
+	}
+}
+
+// proxied runs r through the proxy's span hooks, as ProxyHandler and the
+// backend's ModifyResponse do, and returns the request sent upstream
+func proxied(tr *tracer, r *http.Request) *http.Request {
+	upstream := tr.startProxySpans(r, "/quickapi/test1", "serverful", time.Now())
+	tr.upstreamResponded(&http.Response{StatusCode: http.StatusOK, Request: upstream})
+	tr.finishProxySpans(upstream)
+	tr.Flush()
+	return upstream
+}
+
+func TestProxySpansContinueTrace(t *testing.T) {
+	exporter := &memoryExporter{}
+	tr := newTracer(exporter)
+	r := httptest.NewRequest(http.MethodGet, "/quickapi/test1", nil)
+	r.Header.Set("traceparent", "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01")
+	upstream := proxied(tr, r)
+
+	spans := exporter.Spans()
+	if len(spans) != 2 {
+		t.Fatalf("exported %d spans, want 2", len(spans))
+	}
+	client, server := spans[0], spans[1]
+	if server.Kind != spanKindServer || client.Kind != spanKindClient {
+		t.Fatalf("span kinds %d, %d", server.Kind, client.Kind)
+	}
+	if server.TraceID != "4bf92f3577b34da6a3ce929d0e0e4736" || client.TraceID != server.TraceID {
+		t.Errorf("trace ids %s, %s", server.TraceID, client.TraceID)
+	}
+	if server.ParentSpanID != "00f067aa0ba902b7" || client.ParentSpanID != server.SpanID {
+		t.Errorf("server parent %s, client parent %s (server %s)", server.ParentSpanID, client.ParentSpanID, server.SpanID)
+	}
+	// The function's span must be a child of the client span
+	forwarded, ok := parseTraceparent(upstream.Header.Get("traceparent"))
+	if !ok || forwarded.TraceID != server.TraceID || forwarded.SpanID != client.SpanID {
+		t.Errorf("forwarded traceparent %q", upstream.Header.Get("traceparent"))
+	}
+	if client.Attributes["http.response.status_code"] != "200" {
+		t.Errorf("client span attributes %v", client.Attributes)
+	}
+}
+
+func TestProxySpansUnsampled(t *testing.T) {
+	exporter := &memoryExporter{}
+	tr := newTracer(exporter)
+	r := httptest.NewRequest(http.MethodGet, "/quickapi/test1", nil)
+	r.Header.Set("traceparent", "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00")
+	upstream := proxied(tr, r)
+
+	if spans := exporter.Spans(); len(spans) != 0 {
+		t.Errorf("exported %d spans of an unsampled trace", len(spans))
+	}
+	// The decision is still propagated upstream
+	if forwarded, _ := parseTraceparent(upstream.Header.Get("traceparent")); forwarded.sampled() {
+		t.Errorf("forwarded traceparent %q is sampled", upstream.Header.Get("traceparent"))
+	}
+}
+
+func TestProxySpansKeepRequestStart(t *testing.T) {
+	tr := newTracer(nil)
+	r := httptest.NewRequest(http.MethodGet, "/quickapi/test1", nil)
+	if upstream := proxied(tr, r); upstream.Header.Get("X-Request-Start") == "" {
+		t.Error("X-Request-Start not set")
+	}
+	r = httptest.NewRequest(http.MethodGet, "/quickapi/test1", nil)
+	r.Header.Set("X-Request-Start", "t=1700000000123456")
+	if upstream := proxied(tr, r); upstream.Header.Get("X-Request-Start") != "t=1700000000123456" {
+		t.Errorf("X-Request-Start from the load balancer replaced by %q", upstream.Header.Get("X-Request-Start"))
+	}
+}
+
+func TestOtlpRequest(t *testing.T) {
+	start := time.Unix(1700000000, 5)
+	body, err := json.Marshal(otlpRequest("demonfaas-proxy", []span{{
+		TraceID: "4bf92f3577b34da6a3ce929d0e0e4736", SpanID: "00f067aa0ba902b7", ParentSpanID: "b7ad6b7169203331",
+		Name: "GET /quickapi/test1", Kind: spanKindServer, Start: start, End: start.Add(time.Millisecond),
+		Attributes: map[string]string{"demonfaas.target": "serverless"},
+	}}))
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	type attribute struct {
+		Key   string
+		Value struct{ StringValue string }
+	}
+	var request struct {
+		ResourceSpans []struct {
+			Resource   struct{ Attributes []attribute }
+			ScopeSpans []struct {
+				Scope struct{ Name string }
+				Spans []struct {
+					TraceID, SpanID, ParentSpanID, Name string
+					Kind                                int
+					StartTimeUnixNano, EndTimeUnixNano  string
+					Attributes                          []attribute
+				}
+			}
+		}
+	}
+	if err := json.Unmarshal(body, &request); err != nil {
+		t.Fatal(err)
+	}
+	resource := request.ResourceSpans[0]
+	if attr := resource.Resource.Attributes[0]; attr.Key != "service.name" || attr.Value.StringValue != "demonfaas-proxy" {
+		t.Errorf("resource attribute %+v", attr)
+	}
+	if resource.ScopeSpans[0].Scope.Name != "demonfaas" {
+		t.Errorf("scope %q", resource.ScopeSpans[0].Scope.Name)
+	}
+	s := resource.ScopeSpans[0].Spans[0]
+	if s.TraceID != "4bf92f3577b34da6a3ce929d0e0e4736" || s.SpanID != "00f067aa0ba902b7" || s.ParentSpanID != "b7ad6b7169203331" {
+		t.Errorf("span ids %+v", s)
+	}
+	if s.Name != "GET /quickapi/test1" || s.Kind != spanKindServer {
+		t.Errorf("span %q kind %d", s.Name, s.Kind)
+	}
+	// OTLP/JSON encodes 64-bit nanosecond timestamps as strings
+	if s.StartTimeUnixNano != "1700000000000000005" || s.EndTimeUnixNano != "1700000000001000005" {
+		t.Errorf("timestamps %s, %s", s.StartTimeUnixNano, s.EndTimeUnixNano)
+	}
+	if len(s.Attributes) != 1 || s.Attributes[0].Key != "demonfaas.target" || s.Attributes[0].Value.StringValue != "serverless" {
+		t.Errorf("attributes %+v", s.Attributes)
+	}
+}
@@ -0,0 +1,258 @@
+"""Offline workload classifier for the routes of a Flask (WSGI) app.
+
+Replays a sample workload against the app in-process, measures every
+route's wall time, CPU time, blocking I/O time, allocations and import
+footprint, and labels it ``compute``, ``io`` or ``quick``. The result is
+written as JSON: ``routes`` has the same ``route``/``function`` entries as
+the ApiTransformation spec, and ``functions`` holds the resource profile
+``faas-cli demonfaas --classes`` turns into stack.yml requests.
+
+    python demonfaas/route_classifier.py --path benchmark-kubernetes \\
+        --workload demonfaas/sample_workload.json --output route-classes.json
+"""
+import argparse
+import importlib
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from werkzeug.exceptions import HTTPException
+
+# Split function that serves each workload class
+DEFAULT_FUNCTIONS = {'compute': 'compute', 'io': 'data', 'quick': 'quick'}
+
+IMPORT_PROBE = """
+import resource, sys
+import {module}
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(sys.modules))
+"""
+
+ROUTES_PROBE = """
+import json
+from {module} import {attr} as app
+print(json.dumps(sorted({{rule.rule for rule in app.url_map.iter_rules()}})))
+"""
+
+
+def load_app(path, target):
+    module_name, _, attr = target.partition(':')
+    sys.path.insert(0, path)
+    os.chdir(path)
+    return getattr(importlib.import_module(module_name), attr or 'app')
+
+
+def match_rule(app, method, path):
+    adapter = app.url_map.bind('localhost')
+    try:
+        rule, _ = adapter.match(path.split('?')[0], method=method, return_rule=True)
+    except HTTPException:
+        return None
+    return rule
+
+
+def timed_request(client, entry):
+    wall, cpu = time.perf_counter_ns(), time.thread_time_ns()
+    response = client.open(entry['path'], method=entry.get('method', 'GET'), data=entry.get('body'))
+    # Drain streamed bodies so their work is measured too
+    response.get_data()
+    return response.status_code, (time.perf_counter_ns() - wall) / 1e6, (time.thread_time_ns() - cpu) / 1e6
+
+
+def replay(app, workload, repeat, warmup):
+    """Wall, CPU and allocation samples per route template."""
+    client = app.test_client()
+    samples = {}
+    for entry in workload:
+        rule = match_rule(app, entry.get('method', 'GET'), entry['path'])
+        if rule is None:
+            print(f"Skipping {entry['path']}: no route matches", file=sys.stderr)
+            continue
+        route = samples.setdefault(rule.rule, {'view': app.view_functions[rule.endpoint], 'paths': [],
+                                               'status': set(), 'wall': [], 'cpu': [], 'alloc': []})
+        route['paths'].append(entry['path'])
+
+        # First requests open pools and fill caches; those costs are not the route's
+        for _ in range(warmup):
+            timed_request(client, entry)
+        for _ in range(entry.get('count', repeat)):
+            status, wall, cpu = timed_request(client, entry)
+            route['status'].add(status)
+            route['wall'].append(wall)
+            route['cpu'].append(cpu)
+
+    # tracemalloc slows every allocation down, so it gets its own pass
+    tracemalloc.start()
+    for entry in workload:
+        rule = match_rule(app, entry.get('method', 'GET'), entry['path'])
+        if rule is None:
+            continue
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        timed_request(client, entry)
+        samples[rule.rule]['alloc'].append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return samples
+
+
+def import_footprint(path, module):
+    """Import time, RSS and module count of a fresh interpreter importing ``module``."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_PROBE.format(module=module)],
+                            cwd=path, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Could not import {module}: {result.stderr.strip().splitlines()[-1:]}", file=sys.stderr)
+        return {'import_ms': None, 'import_rss_kb': None, 'modules': None}
+
+    # "import time: self [us] | cumulative | imported package", one line per module loaded
+    self_us = [int(line.split('|')[0].split(':')[1]) for line in result.stderr.splitlines()
+               if line.startswith('import time:') and line.split('|')[0].split(':')[1].strip().isdigit()]
+    rss_kb, modules = result.stdout.split()
+    return {'import_ms': round(sum(self_us) / 1000, 1), 'import_rss_kb': int(rss_kb), 'modules': int(modules)}
+
+
+def served_routes(path, target):
+    """Rules of the WSGI app ``target`` of the function project at ``path``, or an empty set."""
+    module_name, _, attr = target.partition(':')
+    if not os.path.isdir(path):
+        print(f"No function project at {path}", file=sys.stderr)
+        return set()
+    # A fresh interpreter, as every project names its package ``app``
+    result = subprocess.run([sys.executable, '-c', ROUTES_PROBE.format(module=module_name, attr=attr or 'app')],
+                            cwd=path, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Could not load {target} from {path}: {result.stderr.strip().splitlines()[-1:]}", file=sys.stderr)
+        return set()
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+
+def serving_function(template, preferred, served):
+    """``preferred`` if its image serves ``template``, else another function that does, else None."""
+    if template in served.get(preferred, ()):
+        return preferred
+    return next((name for name, rules in served.items() if template in rules), None)
+
+
+def profile_route(route, imports):
+    wall = statistics.median(route['wall'])
+    cpu = statistics.median(route['cpu'])
+    blocking = max(wall - cpu, 0.0)
+    return {
+        'samples': len(route['wall']),
+        'status': sorted(route['status']),
+        'wall_ms': round(wall, 3),
+        'wall_ms_max': round(max(route['wall']), 3),
+        'cpu_ms': round(cpu, 3),
+        'blocking_ms': round(blocking, 3),
+        'io_ratio': round(blocking / wall, 3) if wall else 0.0,
+        'alloc_peak_kb': round(max(route['alloc'], default=0) / 1024, 1),
+        **imports,
+    }
+
+
+def classify(profile, quick_ms, io_ratio, io_ms):
+    # A short route that mostly waits on a database still belongs with the io routes
+    if profile['io_ratio'] >= io_ratio and profile['blocking_ms'] >= io_ms:
+        return 'io'
+    if profile['wall_ms'] < quick_ms:
+        return 'quick'
+    return 'compute'
+
+
+def function_requests(profiles):
+    """Kubernetes resource requests covering the heaviest route of a function."""
+    rss_kb = max((p['import_rss_kb'] or 0) + p['alloc_peak_kb'] for p in profiles)
+    cpu_share = min(max(p['cpu_ms'] / p['wall_ms'] if p['wall_ms'] else 0 for p in profiles), 1.0)
+    memory_mi = max(16, math.ceil(rss_kb / 1024 / 16) * 16)
+    cpu_m = max(50, math.ceil(cpu_share * 1000 / 50) * 50)
+    return {'memory': f"{memory_mi}Mi", 'cpu': f"{cpu_m}m"}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', required=True, help='project directory containing the app package')
+    parser.add_argument('--app', default='app.app:app', help='WSGI app as module:attribute')
+    parser.add_argument('--workload', required=True, help='JSON workload, see demonfaas/sample_workload.json')
+    parser.add_argument('--output', default='route-classes.json')
+    parser.add_argument('--repeat', type=int, default=5, help='measured requests per workload entry')
+    parser.add_argument('--warmup', type=int, default=1, help='unmeasured requests per workload entry')
+    parser.add_argument('--quick-ms', type=float, default=5.0, help='median wall time below which a route is quick')
+    parser.add_argument('--io-ratio', type=float, default=0.5,
+                        help='share of wall time spent blocked above which a route is io')
+    parser.add_argument('--io-ms', type=float, default=1.0, help='median blocked time a route needs to be io')
+    parser.add_argument('--function', action='append', default=[], metavar='CLASS=FUNCTION',
+                        help='override the function serving a class, e.g. io=data')
+    parser.add_argument('--split-path', default='benchmark-openfaas',
+                        help='directory of the split function projects (benchmark-app-<function>)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output)
+    path = os.path.abspath(args.path)
+    split_path = os.path.abspath(args.split_path)
+    functions = dict(DEFAULT_FUNCTIONS, **dict(item.split('=', 1) for item in args.function))
+
+    with open(args.workload) as f:
+        workload = json.load(f)
+    # Settings the replay needs, e.g. disabling result caches so handlers really run
+    os.environ.update(workload.get('env', {}))
+    # Keep the app from binding its standalone metrics port while it is replayed
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='demonfaas-'))
+
+    # Routes each function image serves, so no route is sent to a function that would 404 it
+    served = {name: served_routes(os.path.join(split_path, f"benchmark-app-{name}"), args.app)
+              for name in sorted(set(functions.values()))}
+
+    app = load_app(path, args.app)
+    samples = replay(app, workload['requests'], args.repeat, args.warmup)
+
+    footprints = {}
+    routes = []
+    for template, route in samples.items():
+        module = route['view'].__module__
+        if module not in footprints:
+            footprints[module] = import_footprint(path, module)
+        profile = profile_route(route, footprints[module])
+        workload_class = classify(profile, args.quick_ms, args.io_ratio, args.io_ms)
+        function = serving_function(template, functions[workload_class], served)
+        if function is None:
+            print(f"Skipping {template}: no function serves it, it stays serverful", file=sys.stderr)
+            continue
+        if function != functions[workload_class]:
+            print(f"{template} is {workload_class}, but {functions[workload_class]} does not serve it; "
+                  f"routing it to {function}", file=sys.stderr)
+        routes.append({'route': template, 'function': function, 'class': workload_class,
+                       'module': module, 'paths': sorted(set(route['paths'])), 'profile': profile})
+
+    by_function = {}
+    for route in routes:
+        by_function.setdefault(route['function'], []).append(route)
+    result = {
+        'app': args.app,
+        'thresholds': {'quick_ms': args.quick_ms, 'io_ratio': args.io_ratio, 'io_ms': args.io_ms},
+        'routes': routes,
+        'functions': {name: {'classes': sorted({r['class'] for r in members}),
+                             'routes': [r['route'] for r in members],
+                             'requests': function_requests([r['profile'] for r in members])}
+                      for name, members in by_function.items()},
+    }
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+        f.write('\n')
+
+    for route in routes:
+        p = route['profile']
+        print(f"{route['route']:<32} {route['class']:<8} -> {route['function']:<8} "
+              f"wall {p['wall_ms']:.1f}ms cpu {p['cpu_ms']:.1f}ms blocked {p['io_ratio']:.0%} "
+              f"alloc {p['alloc_peak_kb']:.0f}KiB import {p['import_ms']}ms")
+    print(f"Wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
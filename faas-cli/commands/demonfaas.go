@@ -2,6 +2,7 @@ package commands
 
 import (
 	"bufio"
+	"encoding/json"
 	"fmt"
 	"os"
 	"os/exec"
@@ -32,6 +33,7 @@ func d_assert(predicate bool) {
 var (
 	projectPath       string
 	dockerhubUsername string
+	classesPath       string
 )
 
 const (
@@ -45,6 +47,7 @@ func init() {
 
 	demonfaasCmd.Flags().StringVar(&projectPath, "path", "", "original project path directory")
 	demonfaasCmd.Flags().StringVar(&dockerhubUsername, "username", "", "dockerhub username")
+	demonfaasCmd.Flags().StringVar(&classesPath, "classes", "", "route classes written by demonfaas/route_classifier.py")
 
 	faasCmd.AddCommand(demonfaasCmd)
 }
@@ -127,6 +130,51 @@ CMD ["fwatchdog"]`
 	return nil
 }
 
+// routeClasses is the part of the route classifier output the splitter uses
+type routeClasses struct {
+	Functions map[string]struct {
+		Classes  []string          `json:"classes"`
+		Requests map[string]string `json:"requests"`
+	} `json:"functions"`
+}
+
+// functionProfile renders the measured workload class and resource requests of a function as stack.yml fields
+func functionProfile(classes *routeClasses, function string) string {
+	if classes == nil {
+		return ""
+	}
+	profile, ok := classes.Functions[function]
+	if !ok {
+		return ""
+	}
+
+	fields := "\n    labels:\n      com.demonfaas.workload: " + strings.Join(profile.Classes, "-")
+	if len(profile.Requests) > 0 {
+		fields += "\n    requests:"
+		for _, resource := range []string{"memory", "cpu"} {
+			if value, ok := profile.Requests[resource]; ok {
+				fields += "\n      " + resource + ": " + value
+			}
+		}
+	}
+	return fields
+}
+
+func loadRouteClasses() (*routeClasses, error) {
+	if classesPath == "" {
+		return nil, nil
+	}
+	data, err := os.ReadFile(classesPath)
+	if err != nil {
+		return nil, fmt.Errorf("reading route classes: %w", err)
+	}
+	classes := &routeClasses{}
+	if err := json.Unmarshal(data, classes); err != nil {
+		return nil, fmt.Errorf("parsing route classes: %w", err)
+	}
+	return classes, nil
+}
+
 func generateStackYaml(cmd *cobra.Command, args []string) error {
 	stackTemplate := `provider:
  name: openfaas
@@ -138,20 +186,43 @@ functions:
     handler: ./benchmark-app
     image: @@@/demonfaas-benchmark-app:latest
     route:
+    environment:
+      DB_HOST: postgres-db-service
+      DB_PORT: 5432
+      DB_POOL_MIN_SIZE: 1
+      DB_POOL_MAX_SIZE: 4
   compute:
     lang: dockerfile
     handler: ./benchmark-app-compute
     image: @@@/demonfaas-benchmark-app-compute:latest
+    environment:
+      TRACE_SERVICE_NAME: compute@@compute@@
   data:
     lang: dockerfile
     handler: ./benchmark-app-data
     image: @@@/demonfaas-benchmark-app-data:latest
+    environment:
+      TRACE_SERVICE_NAME: data
+      DB_HOST: postgres-db-service.default.svc.cluster.local
+      DB_PORT: 5432
+      DB_POOL_MIN_SIZE: 1
+      DB_POOL_MAX_SIZE: 4@@data@@
   quick:
     lang: dockerfile
     handler: ./benchmark-app-quick
-    image: @@@/demonfaas-benchmark-app-quick:latest`
+    image: @@@/demonfaas-benchmark-app-quick:latest
+    environment:
+      TRACE_SERVICE_NAME: quick@@quick@@`
+
+	classes, err := loadRouteClasses()
+	if err != nil {
+		return err
+	}
 
 	newStack := strings.Replace(stackTemplate, "@@@", dockerhubUsername, -1)
+	for _, function := range []string{"compute", "data", "quick"} {
+		newStack = strings.Replace(newStack, "@@"+function+"@@", functionProfile(classes, function), -1)
+	}
 
 	file, err := os.OpenFile(resultPath+"/"+"stack.yml", os.O_RDWR|os.O_CREATE|os.O_TRUNC, 0755)
 	if err != nil {
@@ -221,8 +292,12 @@ func runScript(cmd *cobra.Command, args []string) error {
 func preRun(cmd *cobra.Command, args []string) error {
 	d_print("pre run demonfass with dockerfile", projectPath)
 
-	modifyAndGenerateDockerfile(cmd, args)
-	generateStackYaml(cmd, args)
+	if err := modifyAndGenerateDockerfile(cmd, args); err != nil {
+		return err
+	}
+	if err := generateStackYaml(cmd, args); err != nil {
+		return err
+	}
 
 	return nil
 }